@@ -0,0 +1,228 @@
+""" Benchmark & profile the stages of the decision tree pipeline
+
+Times each stage on adult.data and on synthetic copies with the rows repeated
+(1x, 10x, 100x by default) and writes the results as JSON, e.g.
+
+    python benchmark.py --scales 1,10 --output bench_results.json
+    python benchmark.py --compare bench_results.json --output bench_new.json
+    python benchmark.py --max-depth 3 --compare bench_results.json --output bench_small.json
+
+Each stage is run untraced for the time, then once more under tracemalloc for
+the peak memory and the net number of memory blocks retained at the end, the
+blocks of the result included (not the number of allocations).
+The list based stages (clean_data, encode, find_best_split, classify) are
+skipped above --max-list-rows, they hold every raw string in memory and
+encode is quadratic in the number of categories.
+"""
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from data_process import CONTINUOUS_FEATURES, clean_data, encode, ingest, load_feature_dict
+from decision_tree import DecisionTree
+
+
+def write_scaled_file(source_path, scale, directory):
+    """ Write the data rows of source_path scale times into a new file
+
+    :param source_path: adult data file
+    :param scale: number of copies of the rows
+    :param directory: directory of the new file
+    :type source_path: str
+    :type scale: int
+    :type directory: str
+    :return: path of the new file
+    :rtype: str
+    """
+    with open(source_path) as f:
+        rows = f.read().rstrip('\n') + '\n'
+    file_path = os.path.join(directory, 'adult-x%d.data' % scale)
+    with open(file_path, 'w') as f:
+        for _ in range(scale):
+            f.write(rows)
+        f.write('\n')  # blank last line like adult.data
+    return file_path
+
+
+def measure(func, repeat=1, trace=True, profile_path=None):
+    """ Run func and measure it
+
+    :param func: stage to run, without arguments
+    :param repeat: number of untraced runs, the best time is reported
+    :param trace: run once more under tracemalloc
+    :param profile_path: write cProfile stats of one more run to this path
+    :type func: Callable
+    :type repeat: int
+    :type trace: bool
+    :type profile_path: str
+    :return: return value of func & measurements
+    :rtype: object, Dict
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        result = None
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    measurements = {'seconds': min(times)}
+    if trace:
+        result = None
+        tracemalloc.start()
+        blocks = sys.getallocatedblocks()
+        result = func()
+        # net change of the live blocks, the blocks freed again by func are not counted
+        measurements['retained_blocks'] = sys.getallocatedblocks() - blocks
+        measurements['peak_memory_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    if profile_path is not None:
+        profile = cProfile.Profile()
+        profile.runcall(func)
+        profile.dump_stats(profile_path)
+    return result, measurements
+
+
+def run(args):
+    """ Run all stages at all scales
+
+    :param args: command line arguments
+    :type args: argparse.Namespace
+    :return: benchmark records
+    :rtype: List[Dict]
+    """
+    records = []
+    feature_dict = load_feature_dict(args.dict_path)
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            file_path = write_scaled_file(args.data, scale, directory)
+
+            def stage(name, func, rows=None):
+                profile_path = None
+                if args.profile:
+                    os.makedirs(args.profile, exist_ok=True)
+                    profile_path = os.path.join(args.profile, '%s-x%d.prof' % (name, scale))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    result, measurements = measure(func, args.repeat, not args.no_memory, profile_path)
+                if rows is None:
+                    rows = len(result)
+                record = {'stage': name, 'scale': scale, 'rows': rows}
+                record.update(measurements)
+                record['rows_per_second'] = rows / measurements['seconds'] if measurements['seconds'] > 0 else None
+                records.append(record)
+                print('%-28s x%-4d %9d rows %9.4f s %12.0f rows/s' % (
+                    name, scale, rows, record['seconds'], record['rows_per_second'] or 0))
+                return result
+
+            matrix = stage('ingest', lambda: ingest(file_path, feature_dict))
+            n_rows = len(matrix)
+            data, labels = matrix[:, :-1], matrix[:, -1]
+            run_list = n_rows <= args.max_list_rows
+            if run_list:
+                cleaned = stage('clean_data', lambda: clean_data(file_path), n_rows)
+                stage('encode', lambda: encode(cleaned, args.dict_path), n_rows)
+                del cleaned
+                data_list = data.tolist()
+                label_list = labels.tolist()
+
+            tree = DecisionTree(data, labels, feature_dict, list(CONTINUOUS_FEATURES), threshold=args.threshold,
+                                max_depth=args.max_depth, min_samples_leaf=args.min_samples_leaf,
+                                min_impurity_decrease=args.min_impurity_decrease, max_leaf_nodes=args.max_leaf_nodes)
+
+            def create_tree():
+                tree.root = None
+                return tree.create_tree(data, labels, feature_idx_list=list(range(data.shape[1])))
+            stage('create_tree', create_tree, n_rows)
+            records[-1]['nodes'] = len(tree.compile())
+
+            all_features = list(range(data.shape[1]))
+            columns = [data[:, i] for i in all_features]
+            all_rows = np.arange(n_rows)
+            stage('find_best_split_rows', lambda: tree.find_best_split_rows(columns, labels, all_rows, all_features),
+                  n_rows)
+            if run_list:
+                stage('find_best_split', lambda: tree.find_best_split(data_list, label_list, all_features), n_rows)
+                stage('classify', lambda: [tree.classify(row) for row in data_list], n_rows)
+
+            stage('predict_batch', lambda: tree.predict_batch(data), n_rows)
+            compiled = tree.compile()
+            stage('compiled_predict_batch', lambda: compiled.predict_batch(data), n_rows)
+            if run_list:
+                stage('compiled_predict', lambda: [compiled.predict(row) for row in data_list], n_rows)
+                del data_list, label_list
+            os.remove(file_path)
+    return records
+
+
+def compare(records, previous_records):
+    """ Print the time ratio of each stage against a previous run
+
+    :param records: records of this run
+    :param previous_records: records of the previous run
+    :type records: List[Dict]
+    :type previous_records: List[Dict]
+    """
+    previous = {(record['stage'], record['scale']): record for record in previous_records}
+    print('\n%-28s %-5s %10s %10s %7s' % ('stage', 'scale', 'before s', 'after s', 'ratio'))
+    for record in records:
+        before = previous.get((record['stage'], record['scale']))
+        if before is None:
+            continue
+        ratio = record['seconds'] / before['seconds'] if before['seconds'] > 0 else float('inf')
+        print('%-28s x%-4d %10.4f %10.4f %6.2fx' % (record['stage'], record['scale'], before['seconds'],
+                                                    record['seconds'], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', default='adult/adult.data', help='adult data file to scale')
+    parser.add_argument('--dict-path', default='my_dict.json', help='feature dictionary')
+    parser.add_argument('--scales', default='1,10,100', help='comma separated row multipliers')
+    parser.add_argument('--threshold', type=int, default=5, help='threshold of DecisionTree')
+    parser.add_argument('--max-depth', type=int, help='max_depth of DecisionTree')
+    parser.add_argument('--min-samples-leaf', type=int, help='min_samples_leaf of DecisionTree')
+    parser.add_argument('--min-impurity-decrease', type=float, help='min_impurity_decrease of DecisionTree')
+    parser.add_argument('--max-leaf-nodes', type=int, help='max_leaf_nodes of DecisionTree')
+    parser.add_argument('--repeat', type=int, default=1, help='untraced runs per stage, the best is reported')
+    parser.add_argument('--max-list-rows', type=int, default=500000, help='skip the list based stages above this')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc run')
+    parser.add_argument('--profile', help='write cProfile stats of each stage to this directory')
+    parser.add_argument('--output', default='bench_results.json', help='JSON result file')
+    parser.add_argument('--compare', help='JSON result file of a previous run')
+    args = parser.parse_args(argv)
+    args.scales = [int(scale) for scale in args.scales.split(',')]
+
+    if not os.path.exists(args.dict_path):  # create the feature dictionary like main.py
+        with contextlib.redirect_stdout(io.StringIO()):
+            encode(clean_data(args.data), args.dict_path)
+    records = run(args)
+    output = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items()},
+        },
+        'results': records,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print('Results written to ' + args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(records, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+""" Export a trained decision tree as a standalone Python module
+
+The generated module has no imports of this package: predict(data) is one
+function of nested if comparisons on the encode attribute values, so a
+prediction runs no tree interpreter at all. predict_batch(matrix) calls it
+once per row and returns a list, or with vectorized=True evaluates every
+split on the whole matrix with numpy and returns a numpy array, selecting
+the label of each row with numpy.select.
+Both give the same labels as DecisionTree.classify, -1 for a missing tree
+or branch.
+"""
+
+INDENT = '    '
+
+
+def generate_source(root, continuous_features, feature_dict_list=None, vectorized=False):
+    """ Returns the source code of a module classifying rows with the tree
+
+    :param root: root treenode
+    :param continuous_features: index of continuous feature
+    :param feature_dict_list: dict list  key:encode val:feature, used for comments only, None for no comments
+    :param vectorized: generate predict_batch with numpy instead of a loop over predict
+    :type root: TreeNode
+    :type continuous_features: List[int]
+    :type feature_dict_list: List[Dict[int,str]]
+    :type vectorized: bool
+    :rtype: str
+    """
+    lines = ['""" Decision tree classifier generated by codegen.py, do not edit """']
+    if vectorized:
+        lines += ['import numpy as np']
+    lines += ['', '', 'def predict(data):', INDENT + '""" Classify one row of encode attribute values """']
+    lines += _predict_lines(root, continuous_features, feature_dict_list)
+    lines += ['', '']
+    if vectorized:
+        lines += ['def predict_batch(matrix):',
+                  INDENT + '""" Classify many rows, one row of encode attribute values per matrix row, '
+                           'returns a numpy array """',
+                  INDENT + 'matrix = np.asarray(matrix)']
+        lines += _predict_batch_lines(root, continuous_features)
+    else:
+        lines += ['def predict_batch(matrix):',
+                  INDENT + '""" Classify many rows, one row of encode attribute values per matrix row, '
+                           'returns a list """',
+                  INDENT + 'return [predict(data) for data in matrix]']
+    return '\n'.join(lines) + '\n'
+
+
+def write_source(file_path, root, continuous_features, feature_dict_list=None, vectorized=False):
+    """ Write the module of generate_source to a file
+
+    :param file_path: path of the .py file
+    :param root: root treenode
+    :param continuous_features: index of continuous feature
+    :param feature_dict_list: dict list  key:encode val:feature, used for comments only
+    :param vectorized: generate predict_batch with numpy
+    :type file_path: str
+    :type root: TreeNode
+    :type continuous_features: List[int]
+    :type feature_dict_list: List[Dict[int,str]]
+    :type vectorized: bool
+    """
+    with open(file_path, 'w') as f:
+        f.write(generate_source(root, continuous_features, feature_dict_list, vectorized))
+
+
+def _test_source(node, continuous_features, column):
+    """ Split test of a node on the attribute values in column, the same test as the split in create_tree """
+    op = '<=' if node.attr_idx in continuous_features else '=='
+    return '%s %s %d' % (column % node.attr_idx, op, int(node.attr_val))
+
+
+def _comment(node, continuous_features, feature_dict_list):
+    if feature_dict_list is None:
+        return ''
+    name = feature_dict_list[node.attr_idx].get(int(node.attr_val))
+    if name is None:
+        return ''
+    # repr keeps the comment on one line whatever the dictionary holds
+    return '  # %s %r' % ('<=' if node.attr_idx in continuous_features else '==', str(name))
+
+
+def _predict_lines(root, continuous_features, feature_dict_list):
+    """ Nested ifs of predict, the same routing as DecisionTree.traverse """
+    lines = []
+    # (node or 'else:' line, depth of indent)
+    stack = [(root, 1)]
+    while stack:
+        node, depth = stack.pop()
+        indent = INDENT * depth
+        if isinstance(node, str):  # else marker
+            lines.append(indent + node)
+            continue
+        if node is None:
+            lines.append(indent + 'return -1')
+        elif node.is_leaf:
+            lines.append(indent + 'return %d' % int(node.result))
+        elif node.true_brunch:
+            lines.append(indent + 'if %s:%s' % (_test_source(node, continuous_features, 'data[%d]'),
+                                                 _comment(node, continuous_features, feature_dict_list)))
+            # popped in order: true branch, 'else:', false branch
+            stack.append((node.false_brunch, depth + 1))
+            stack.append(('else:', depth))
+            stack.append((node.true_brunch, depth + 1))
+        else:  # no true branch, every row goes to the false branch
+            stack.append((node.false_brunch, depth))
+    return lines
+
+
+def _predict_batch_lines(root, continuous_features):
+    """ Masks of the rows reaching each node and numpy.select over the leaves """
+    lines = []
+    conditions = []
+    labels = []
+    # (node, name of the mask of the rows reaching the node, None for all rows)
+    stack = [(root, None)]
+    n_masks = 0
+    while stack:
+        node, mask = stack.pop()
+        if node is None or node.is_leaf:
+            label = -1 if node is None else int(node.result)
+            if mask is None:
+                return lines + [INDENT + 'return np.full(len(matrix), %d, dtype=np.int64)' % label]
+            conditions.append(mask)
+            labels.append(str(label))
+            continue
+        if not node.true_brunch:
+            stack.append((node.false_brunch, mask))
+            continue
+        test = 't%d' % n_masks
+        true_mask = 'm%d' % (n_masks * 2 + 1)
+        false_mask = 'm%d' % (n_masks * 2 + 2)
+        n_masks += 1
+        lines.append(INDENT + '%s = %s' % (test, _test_source(node, continuous_features, 'matrix[:, %d]')))
+        if mask is None:
+            lines.append(INDENT + '%s = %s' % (true_mask, test))
+            lines.append(INDENT + '%s = ~%s' % (false_mask, test))
+        else:
+            lines.append(INDENT + '%s = %s & %s' % (true_mask, mask, test))
+            lines.append(INDENT + '%s = %s & ~%s' % (false_mask, mask, test))
+        stack.append((node.false_brunch, false_mask))
+        stack.append((node.true_brunch, true_mask))
+    lines.append(INDENT + 'return np.select([%s], [%s], default=-1).astype(np.int64)' % (
+        ', '.join(conditions), ', '.join(labels)))
+    return lines
@@ -0,0 +1,161 @@
+import numpy as np
+
+from tree_node import TreeNode
+
+# split kind of a node
+LEAF = 0
+CATEGORY = 1  # data[feature] == value
+CONTINUOUS = 2  # data[feature] <= value
+
+
+class CompiledTree:
+    """ The definition of CompiledTree, a trained decision tree in flat node arrays
+
+    Node i tests data[feature[i]] against value[i] according to kind[i] and
+    continues with true_child[i] or false_child[i], a LEAF node returns
+    leaf_value[i]. Node 0 is the root.
+
+    :param feature: attribute index of the split of each node
+    :param value: attribute value of the split of each node
+    :param kind: split kind of each node, LEAF, CATEGORY or CONTINUOUS
+    :param true_child: node index of the true branch
+    :param false_child: node index of the false branch
+    :param leaf_value: label of each leaf node, the majority training label of split nodes (-1 if unknown)
+    :type feature: numpy.ndarray
+    :type value: numpy.ndarray
+    :type kind: numpy.ndarray
+    :type true_child: numpy.ndarray
+    :type false_child: numpy.ndarray
+    :type leaf_value: numpy.ndarray
+    """
+    def __init__(self, feature, value, kind, true_child, false_child, leaf_value):
+        self.feature = feature
+        self.value = value
+        self.kind = kind
+        self.true_child = true_child
+        self.false_child = false_child
+        self.leaf_value = leaf_value
+        # one plain tuple per node is much faster than numpy arrays for single row lookups,
+        # built on the first predict so that memory-mapped arrays are not copied by batch-only users
+        self._nodes = None
+
+    def __len__(self):
+        return len(self.kind)
+
+    @classmethod
+    def from_tree(cls, root, continuous_features):
+        """ Compile a tree of TreeNode into flat node arrays
+
+        :param root: root treenode
+        :param continuous_features: index of continuous feature
+        :type root: TreeNode
+        :type continuous_features: List[int]
+        :rtype: CompiledTree
+        """
+        feature = []
+        value = []
+        kind = []
+        true_child = []
+        false_child = []
+        leaf_value = []
+
+        def add_node():
+            feature.append(0)
+            value.append(0)
+            kind.append(LEAF)
+            true_child.append(-1)
+            false_child.append(-1)
+            leaf_value.append(-1)
+            return len(kind) - 1
+
+        # same routing as DecisionTree.traverse, a missing tree or branch gives -1
+        stack = [(root, add_node())]
+        while stack:
+            node, i = stack.pop()
+            if node is None:
+                continue
+            # the label of a split node is kept for update & prune of a loaded tree
+            leaf_value[i] = node.result
+            if node.is_leaf:
+                continue
+            false_i = add_node()
+            stack.append((node.false_brunch, false_i))
+            false_child[i] = false_i
+            if node.true_brunch:
+                feature[i] = node.attr_idx
+                value[i] = node.attr_val
+                kind[i] = CONTINUOUS if feature[i] in continuous_features else CATEGORY
+                true_i = add_node()
+                stack.append((node.true_brunch, true_i))
+                true_child[i] = true_i
+            else:  # no true branch, every row goes to the false branch
+                kind[i] = CATEGORY
+                true_child[i] = false_i
+
+        return cls(np.array(feature, dtype=np.int32), np.array(value, dtype=np.float64),
+                   np.array(kind, dtype=np.int8), np.array(true_child, dtype=np.int32),
+                   np.array(false_child, dtype=np.int32), np.array(leaf_value, dtype=np.int64))
+
+    def to_tree(self):
+        """ Rebuild the tree of TreeNode from the node arrays
+
+        :return: root treenode
+        :rtype: TreeNode
+        """
+        feature = self.feature.tolist()
+        value = self.value.tolist()
+        kind = self.kind.tolist()
+        leaf_value = self.leaf_value.tolist()
+        nodes = [TreeNode(is_leaf=k == LEAF, result=leaf_value[i]) for i, k in enumerate(kind)]
+        for i, node in enumerate(nodes):
+            if not node.is_leaf:
+                node.attr_idx = feature[i]
+                # encode attribute values are int
+                node.attr_val = int(value[i]) if value[i] == int(value[i]) else value[i]
+                node.true_brunch = nodes[self.true_child[i]]
+                node.false_brunch = nodes[self.false_child[i]]
+        return nodes[0]
+
+    def predict(self, data):
+        """ Classify one row without recursion
+
+        :param data: encode attribute values of one data
+        :type data: List[int]
+        :return: predicted label, -1 error or empty tree
+        :rtype: int
+        """
+        nodes = self._nodes
+        if nodes is None:
+            nodes = self._nodes = list(zip(self.feature.tolist(), self.value.tolist(), self.kind.tolist(),
+                                           self.true_child.tolist(), self.false_child.tolist(),
+                                           self.leaf_value.tolist()))
+        feature, value, kind, true_child, false_child, leaf_value = nodes[0]
+        while kind != LEAF:
+            x = data[feature]
+            if x <= value if kind == CONTINUOUS else x == value:
+                feature, value, kind, true_child, false_child, leaf_value = nodes[true_child]
+            else:
+                feature, value, kind, true_child, false_child, leaf_value = nodes[false_child]
+        return leaf_value
+
+    def predict_batch(self, matrix):
+        """ Classify many rows, all rows move down one level per step
+
+        :param matrix: encode attribute matrix, one row per data
+        :type matrix: numpy.ndarray | List[List[int]]
+        :return: predicted label of each row
+        :rtype: numpy.ndarray
+        """
+        matrix = np.asarray(matrix)
+        node = np.zeros(len(matrix), dtype=np.int32)
+        rows = np.arange(len(matrix))
+        while len(rows) > 0:
+            kind = self.kind[node[rows]]
+            rows = rows[kind != LEAF]
+            if len(rows) == 0:
+                break
+            i = node[rows]
+            x = matrix[rows, self.feature[i]]
+            is_true = np.where(self.kind[i] == CONTINUOUS, x <= self.value[i], x == self.value[i])
+            node[rows] = np.where(is_true, self.true_child[i], self.false_child[i])
+        return self.leaf_value[node]
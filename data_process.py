@@ -1,11 +1,32 @@
 import csv
+import hashlib
 import json
 import os.path
+import shutil
+from bisect import bisect_left
+from collections import Counter
 
+import numpy as np
 
-def process_dataset(file_path='adult/adult.data'):
+# colnames = ['age','workclass','fnlwgt','education','education-num','marital-status',
+#             'occupation','relationship','race','sex','capital-gain','capital-loss',
+#             'hours-per-week','income']
+CONTINUOUS_FEATURES = [0,2,4,10,11,12]  # column index of features
+CATEGORY_FEATURES = [1,3,5,6,7,8,9,13]
+
+
+# store_dir streams the data file chunk by chunk into an on-disk columnar store and returns it memory-mapped
+# bins sets the groups of the continuous features when the feature dictionary is created, see create_feature_dict,
+# and must match the bins of an existing one, see load_feature_dict
+def process_dataset(file_path='adult/adult.data', columnar=False, store_dir=None, bins=None):
+    if store_dir is not None:
+        for _ in stream_dataset(file_path, store_dir, bins=bins):
+            pass
+        return open_store(store_dir)
     cleaned = clean_data(file_path)
-    data, feature_dict, continuous_features, category_features = encode(cleaned)
+    data, feature_dict, continuous_features, category_features = encode(cleaned, columnar=columnar, bins=bins)
+    if columnar:  # attribute matrix & label vector
+        return data[:, :-1], data[:, -1], feature_dict, continuous_features, category_features
     train_data = map(lambda row: row[:-1], data)
     train_label = map(lambda row: row[-1], data)
     return list(train_data), list(train_label), feature_dict, continuous_features, category_features
@@ -49,6 +70,22 @@ def replace(my_list, lookup_dict):
     return res
 
 
+# reverse lookup maps of the category features: feature -> encode, None for the continuous features
+def category_lookup(feature_dict):
+    lookup = [None] * len(feature_dict)
+    for i in CATEGORY_FEATURES:
+        lookup[i] = {v: k for k, v in feature_dict[i].items()}
+    return lookup
+
+
+# encode the values of category column i by its reverse lookup map, one dict lookup per value
+def lookup_column(values, lookup, i):
+    try:
+        return [lookup[x] for x in values]
+    except KeyError as e:
+        raise ValueError("%r of column %d is NOT in the feature dictionary" % (e.args[0], i))
+
+
 # convert a row to readable form based on the input feature dictionary
 def make_readable(row, f_dict):
     readable = []
@@ -57,58 +94,106 @@ def make_readable(row, f_dict):
     return readable
 
 
-def encode(cleaned, file_path='my_dict.json'):
-    # colnames = ['age','workclass','fnlwgt','education','education-num','marital-status',
-    #             'occupation','relationship','race','sex','capital-gain','capital-loss',
-    #             'hours-per-week','income']
+# category_values: set of the values of each category feature
+# bins: 'fixed' groups the continuous features by hand-made bounds, otherwise the bounds are learned from
+# continuous_counts (value -> number of rows of each continuous feature): 'exact' keeps every distinct value as a
+# group so the tree can split between any two values, an int groups into that many quantile bins
+def create_feature_dict(category_values, continuous_counts=None, bins='fixed'):
+    # create lookup dictionary for categorical and continuous features
+    category_dict = []
+    continuous_dict=[]
+    for lookup_values in category_values:
+        category_dict.append(dict(zip(range(len(lookup_values)),lookup_values)))
+    if bins != 'fixed':
+        for value_counts in continuous_counts:
+            bounds = learn_bounds(value_counts, None if bins == 'exact' else bins)
+            labels = [format_bound(v) for v in bounds] + [format_bound(bounds[-1]) + '+' if bounds else '+']
+            continuous_dict.append(dict(zip(range(len(labels)), labels)))
+        return join_feature_dict(continuous_dict, category_dict)
+    # age: <=30,31-40,41-50,51-60,61+
+    continuous_dict.append(dict(zip(range(5), ['30', '40', '50', '60', '60+'])))
+    # fnlwgt(in 1e6): <=0.6, 0.6+
+    continuous_dict.append(dict(zip(range(2), ['600000', '600000+'])))
+    # education-num: <=11, 11-15, 15+
+    continuous_dict.append(dict(zip(range(3), ['11', '15', '15+'])))
+    # captital-gain: <=5000, 5000-10000, 10000-15000, 15000-20000, 20000+
+    continuous_dict.append(dict(zip(range(5),['5000','10000','15000','20000','20000+'])))
+    # capital-loss: <=1000, 1000-1500, 1500-2000, 2000+
+    continuous_dict.append(dict(zip(range(4),['1000','1500','2000','2000+'])))
+    # hours-per-week: <=20, 20-40, 40+
+    continuous_dict.append(dict(zip(range(3), ['20', '40', '40+'])))
+    return join_feature_dict(continuous_dict, category_dict)
+
+
+# create full list of feature dictionary from the dictionaries of the continuous & category features
+def join_feature_dict(continuous_dict, category_dict):
+    all_features = CONTINUOUS_FEATURES+CATEGORY_FEATURES
+    all_dict = continuous_dict+category_dict
+    feature_dict = [d for idx, d in sorted(zip(all_features, all_dict))]
+    # # treat education as ordinal attribute
+    # feature_dict[3] = {"0": "Preschool", "1": "1st-4th", "2": "5th-6th", "3": "7th-8th", "4": "9th","5": "10th", "6": "11th", "7": "12th", "8": "HS-grad", "9": "Assoc-voc", "10": "Assoc-acdm", "11": "Prof-school", "12": "Some-college", "13": "Bachelors", "14": "Masters", "15": "Doctorate"}
+    # continuous_features = [0,2,3,4,10,11,12]  # column index of features
+    # category_features = [1,5,6,7,8,9,13]
+    return feature_dict
+
+
+# upper bounds of the groups of a continuous feature, the values above the last bound form one more group
+# max_bins=None makes every distinct value but the largest a bound, otherwise the bounds are the weighted
+# quantiles of value_counts, so each of the at most max_bins groups holds about the same number of rows
+def learn_bounds(value_counts, max_bins=None):
+    values = np.array(sorted(value_counts), dtype=np.float64)
+    if max_bins is None or len(values) <= max_bins:
+        return values[:-1].tolist()
+    cumulative = np.cumsum([value_counts[v] for v in values.tolist()])
+    targets = cumulative[-1] * np.arange(1, max_bins) / max_bins
+    bounds = np.unique(values[np.searchsorted(cumulative, targets)])
+    return bounds[bounds < values[-1]].tolist()
+
 
-    continuous_features = [0,2,4,10,11,12]  # column index of features
-    category_features = [1,3,5,6,7,8,9,13]
+# bounds are written to the feature dictionary as text, integral values without '.0'
+def format_bound(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+# upper bounds of the groups of a continuous feature from its dictionary, the last group has no bound
+def read_bounds(lookup_dict):
+    return [float(v) for k, v in sorted(lookup_dict.items())[:-1]]
+
+
+# columnar=True returns a compact integer numpy matrix stored column by column instead of row lists
+# bins is used when the feature dictionary file_path is created ('fixed' for None), see create_feature_dict,
+# and must match the bins of an existing one, see load_feature_dict
+def encode(cleaned, file_path='my_dict.json', columnar=False, bins=None):
+    continuous_features = list(CONTINUOUS_FEATURES)
+    category_features = list(CATEGORY_FEATURES)
     columns = list(zip(*cleaned))  # transpose rows to columns for the ease of list operations
     for i in continuous_features:  # convert continuous values from string to float
         columns[i] = [float(x) for x in columns[i]]
 
     if not os.path.exists(file_path):
         # print("Feature dictionary not found. Creating new...")
-    # create lookup dictionary for categorical and continuous features
-        category_dict = []
-        continuous_dict=[]
-        for i in category_features:
-            lookup_values = set(columns[i])
-            category_dict.append(dict(zip(range(len(lookup_values)),lookup_values)))
-        # age: <=30,31-40,41-50,51-60,61+
-        continuous_dict.append(dict(zip(range(5), ['30', '40', '50', '60', '60+'])))
-        # fnlwgt(in 1e6): <=0.6, 0.6+
-        continuous_dict.append(dict(zip(range(2), ['600000', '600000+'])))
-        # education-num: <=11, 11-15, 15+
-        continuous_dict.append(dict(zip(range(3), ['11', '15', '15+'])))
-        # captital-gain: <=5000, 5000-10000, 10000-15000, 15000-20000, 20000+
-        continuous_dict.append(dict(zip(range(5),['5000','10000','15000','20000','20000+'])))
-        # capital-loss: <=1000, 1000-1500, 1500-2000, 2000+
-        continuous_dict.append(dict(zip(range(4),['1000','1500','2000','2000+'])))
-        # hours-per-week: <=20, 20-40, 40+
-        continuous_dict.append(dict(zip(range(3), ['20', '40', '40+'])))
-
-        # create full list of feature dictionary, transform data accordingly
-        all_features = continuous_features+category_features
-        all_dict = continuous_dict+category_dict
-        feature_dict = [d for idx, d in sorted(zip(all_features, all_dict))]
-        # # treat education as ordinal attribute
-        # feature_dict[3] = {"0": "Preschool", "1": "1st-4th", "2": "5th-6th", "3": "7th-8th", "4": "9th","5": "10th", "6": "11th", "7": "12th", "8": "HS-grad", "9": "Assoc-voc", "10": "Assoc-acdm", "11": "Prof-school", "12": "Some-college", "13": "Bachelors", "14": "Masters", "15": "Doctorate"}
-        # continuous_features = [0,2,3,4,10,11,12]  # column index of features
-        # category_features = [1,5,6,7,8,9,13]
-        with open('my_dict.json', 'w') as f:  # save the feature dictionary
-            json.dump(feature_dict, f)
+        feature_dict = create_feature_dict([set(columns[i]) for i in category_features],
+                                           [Counter(columns[i]) for i in continuous_features], bins or 'fixed')
+        save_feature_dict(feature_dict, file_path, bins or 'fixed')
         # print("Feature dictionary is created.")
     else:
         # print("Found existing feature dictionary.")
-        with open('my_dict.json') as f:
-            feature_dict = json.load(f)
-        for i in range(len(feature_dict)):  # convert keys from str to int
-            feature_dict[i] = {int(k): v for k, v in feature_dict[i].items()}
+        feature_dict = load_feature_dict(file_path, bins)
+    for i in continuous_features:  # group continuous values by binary search of the bounds
+        bounds = read_bounds(feature_dict[i])
+        columns[i] = [bisect_left(bounds, x) for x in columns[i]]
+    lookup = category_lookup(feature_dict)  # same maps as ingest, not a list search per value
+    for i in category_features:
+        columns[i] = lookup_column(columns[i], lookup[i], i)
+
+    if columnar:
+        max_code = max(max(d.keys()) for d in feature_dict)
+        matrix = np.empty((len(cleaned), len(feature_dict)), dtype=np.min_scalar_type(max_code), order='F')
+        for i in range(len(feature_dict)):
+            matrix[:, i] = columns[i]
+        print("Data ready to use.")
+        return matrix, feature_dict, continuous_features, category_features
 
-    for i in range(len(feature_dict)):
-        columns[i] = replace(columns[i], feature_dict[i])
     backToRows = list(zip(*columns))  # transpose columns back to rows
     backToRows = [list(row) for row in backToRows]
 
@@ -122,3 +207,177 @@ def encode(cleaned, file_path='my_dict.json'):
     # print("Convert to readable form using feature dictionary: \n",make_readable(backToRows[0], feature_dict))
     # print(feature_dict)
     return backToRows, feature_dict, continuous_features, category_features
+
+
+# the file holds the bins the dictionary was created with next to the dictionaries of the columns
+def save_feature_dict(feature_dict, file_path, bins):
+    with open(file_path, 'w') as f:
+        json.dump({'bins': bins, 'features': feature_dict}, f)
+
+
+# bins=None accepts any dictionary, otherwise ValueError when the dictionary was created with other bins, so that
+# learned groups are never silently replaced by those of an existing dictionary
+def load_feature_dict(file_path='my_dict.json', bins=None):
+    with open(file_path) as f:
+        content = json.load(f)
+    if isinstance(content, list):  # file of the first versions, the bare list of dictionaries
+        feature_dict, file_bins = content, None
+    else:
+        feature_dict, file_bins = content['features'], content['bins']
+    for i in range(len(feature_dict)):  # convert keys from str to int
+        feature_dict[i] = {int(k): v for k, v in feature_dict[i].items()}
+    if file_bins is None:  # the hand-made groups are known, learned ones cannot tell their bins
+        fixed_dict = create_feature_dict([set() for _ in CATEGORY_FEATURES])
+        if all(feature_dict[i] == fixed_dict[i] for i in CONTINUOUS_FEATURES):
+            file_bins = 'fixed'
+    if bins is not None and bins != file_bins:
+        created = 'learned bins of unknown mode' if file_bins is None else 'bins=%r' % (file_bins,)
+        raise ValueError("feature dictionary %s was created with %s, NOT bins=%r; use a new dict_path for it"
+                         % (file_path, created, bins))
+    return feature_dict
+
+
+# columnar dataset like process_dataset(file_path, columnar=True), cached as a binary .npy file
+# the cache is keyed by the content of the data file & the feature dictionary, later runs memory-map it
+def load_dataset(file_path='adult/adult.data', dict_path='my_dict.json', cache_dir='cache', bins=None):
+    if not os.path.exists(dict_path):  # the first run creates the feature dictionary from the data
+        encode(clean_data(file_path), dict_path, columnar=True, bins=bins)
+    feature_dict = load_feature_dict(dict_path, bins)
+
+    digest = hashlib.sha256()
+    for path in (file_path, dict_path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    cache_path = os.path.join(cache_dir, '%s-%s.npy' % (os.path.basename(file_path), digest.hexdigest()[:16]))
+
+    if os.path.exists(cache_path):
+        matrix = np.load(cache_path, mmap_mode='r')
+    else:
+        matrix = ingest(file_path, feature_dict)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, cache_path)  # never leave a partial cache file
+    print("Data ready to use.")
+    return matrix[:, :-1], matrix[:, -1], feature_dict, list(CONTINUOUS_FEATURES), list(CATEGORY_FEATURES)
+
+
+# clean & encode the data file in one pass, same result as encode(clean_data(file_path), columnar=True)
+# with an existing feature dictionary
+def ingest(file_path, feature_dict):
+    return next(iter_encoded_chunks(file_path, feature_dict))
+
+
+# yield the rows of the data file cleaned like clean_data, one row at a time
+def iter_cleaned_rows(file_path):
+    with open(file_path, newline='') as csvfile:
+        for row in csv.reader(csvfile):
+            if len(row) != 15:  # the text row of adult.test & the blank last line
+                continue
+            row = [s.strip().rstrip('.') for s in row]
+            if '?' in row:
+                continue
+            row.pop(13)  # remove the 'native-country' column
+            yield row
+
+
+# yield the data file cleaned & encoded as matrices of at most chunk_rows rows, None for a single matrix
+def iter_encoded_chunks(file_path, feature_dict, chunk_rows=None):
+    n_columns = len(feature_dict)
+    lookup = category_lookup(feature_dict)
+    # upper bounds of the continuous groups, the last group has no bound
+    bounds = [None] * n_columns
+    for i in CONTINUOUS_FEATURES:
+        bounds[i] = read_bounds(feature_dict[i])
+    dtype = np.min_scalar_type(max(max(d.keys()) for d in feature_dict))
+
+    def to_matrix(columns):
+        matrix = np.empty((len(columns[0]), n_columns), dtype=dtype, order='F')
+        for i in range(n_columns):
+            matrix[:, i] = columns[i]
+        return matrix
+
+    columns = [[] for _ in range(n_columns)]
+    n_chunks = 0
+    for row in iter_cleaned_rows(file_path):
+        for i in CONTINUOUS_FEATURES:
+            columns[i].append(bisect_left(bounds[i], float(row[i])))
+        for i in CATEGORY_FEATURES:
+            try:
+                columns[i].append(lookup[i][row[i]])
+            except KeyError:
+                raise ValueError("%r of column %d is NOT in the feature dictionary" % (row[i], i))
+        if len(columns[0]) == chunk_rows:
+            yield to_matrix(columns)
+            n_chunks += 1
+            columns = [[] for _ in range(n_columns)]
+    if len(columns[0]) > 0 or n_chunks == 0:
+        yield to_matrix(columns)
+
+
+# stream the data file into the columnar store store_dir: chunks of chunk_rows rows are cleaned, encoded and
+# appended to one file per column, yielding the number of rows stored so far. The columns are then joined into
+# column-major features.npy & labels.npy, so raw strings are never held in memory for more than one chunk.
+def stream_dataset(file_path, store_dir, dict_path='my_dict.json', chunk_rows=100000, bins=None):
+    if not os.path.exists(dict_path):  # create the feature dictionary from the category values
+        category_values = [set() for _ in CATEGORY_FEATURES]
+        # continuous values are only counted when the bounds are learned, distinct values are far fewer than rows
+        continuous_counts = [Counter() for _ in CONTINUOUS_FEATURES] if bins not in (None, 'fixed') else None
+        for row in iter_cleaned_rows(file_path):
+            for values, i in zip(category_values, CATEGORY_FEATURES):
+                values.add(row[i])
+            if continuous_counts is not None:
+                for value_counts, i in zip(continuous_counts, CONTINUOUS_FEATURES):
+                    value_counts[float(row[i])] += 1
+        save_feature_dict(create_feature_dict(category_values, continuous_counts, bins or 'fixed'), dict_path,
+                          bins or 'fixed')
+    feature_dict = load_feature_dict(dict_path, bins)
+
+    os.makedirs(store_dir, exist_ok=True)
+    n_columns = len(feature_dict)
+    column_paths = [os.path.join(store_dir, 'column%d.bin' % i) for i in range(n_columns)]
+    column_files = [open(path, 'wb') for path in column_paths]
+    n_rows = 0
+    dtype = None
+    try:
+        for chunk in iter_encoded_chunks(file_path, feature_dict, chunk_rows):
+            dtype = chunk.dtype
+            for i in range(n_columns):
+                chunk[:, i].tofile(column_files[i])
+            n_rows += len(chunk)
+            yield n_rows
+    finally:
+        for f in column_files:
+            f.close()
+
+    # a column-major matrix is its columns one after another
+    features_path = os.path.join(store_dir, 'features.npy')
+    with open(features_path + '.tmp', 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                 'fortran_order': True, 'shape': (n_rows, n_columns - 1)})
+        for path in column_paths[:-1]:
+            with open(path, 'rb') as column_file:
+                shutil.copyfileobj(column_file, f)
+    os.replace(features_path + '.tmp', features_path)
+    labels_path = os.path.join(store_dir, 'labels.npy')
+    with open(labels_path + '.tmp', 'wb') as f:
+        np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype),
+                                                 'fortran_order': False, 'shape': (n_rows,)})
+        with open(column_paths[-1], 'rb') as column_file:
+            shutil.copyfileobj(column_file, f)
+    os.replace(labels_path + '.tmp', labels_path)
+    with open(os.path.join(store_dir, 'feature_dict.json'), 'w') as f:
+        json.dump(feature_dict, f)
+    for path in column_paths:
+        os.remove(path)
+
+
+# open the columnar store written by stream_dataset, the matrix & labels are memory-mapped
+def open_store(store_dir):
+    features = np.load(os.path.join(store_dir, 'features.npy'), mmap_mode='r')
+    labels = np.load(os.path.join(store_dir, 'labels.npy'), mmap_mode='r')
+    feature_dict = load_feature_dict(os.path.join(store_dir, 'feature_dict.json'))
+    print("Data ready to use.")
+    return features, labels, feature_dict, list(CONTINUOUS_FEATURES), list(CATEGORY_FEATURES)
@@ -1,28 +1,108 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from heapq import heappop, heappush
+from itertools import count
+from operator import itemgetter
+from time import perf_counter
+
+import numpy as np
+
+from codegen import write_source
+from compiled_tree import CompiledTree
+from impurity import ROUNDING_ERROR, get_criterion
+from instrumentation import TrainingStats
+from model_file import read_model, write_model
+from prediction_cache import PredictionCache
+from shared_array import SharedArray
 from tree_node import TreeNode
 
 
 class DecisionTree:
     """ The definition of DecisionTree
 
-    :param train_data: encode attribute list
-    :param train_label: encode label list
+    :param train_data: encode attribute list, or encode attribute matrix in columnar mode
+    :param train_label: encode label list, or encode label vector in columnar mode
     :param feature_dict_list: dict list  key:encode val:feature (attribute & label)
     :param continuous_features: index of continuous feature
     :param root: root treenode
     :param threshold: when |S| < threshold, it is too small
-    :type train_data:
-    :type train_label: List[int]
+    :param n_jobs: number of worker processes for the split search, 1 builds serially
+    :param parallel_min_rows: nodes with at least this many rows search their split in parallel, with
+        feature_scope='path' the subtrees of the smaller nodes are grown whole by the worker processes
+    :param max_features: number of features sampled as split candidates at each node, None for all
+    :param random_state: seed of the feature sampling
+    :param instrument: collects per node statistics of create_tree, None to disable
+    :param max_depth: nodes at this depth are not split, the root is at depth 0, None for no limit
+    :param min_samples_leaf: minimum number of rows on each side of a split, None for no limit
+    :param min_impurity_decrease: minimum decrease of GINI of a split, weighted by the share of the
+        training rows in the node, None for no limit
+    :param max_leaf_nodes: grow the tree best-first up to this many leaves, None for no limit
+    :param criterion: impurity of the split search, 'gini', 'entropy' or an impurity.Criterion
+    :param feature_scope: 'tree' a split feature is not split again anywhere in the tree, 'path' only not
+        below the node split on it
+    :param cache_size: keep the predicted labels of up to this many distinct rows for classify &
+        predict_batch, None for no cache
+    :type train_data: List[List[int]] | numpy.ndarray
+    :type train_label: List[int] | numpy.ndarray
     :type feature_dict_list: List[Dict[int,str]]
     :type root: TreeNode
     :type threshold: int
+    :type n_jobs: int
+    :type parallel_min_rows: int
+    :type max_features: int
+    :type random_state: int | numpy.random.SeedSequence
+    :type instrument: instrumentation.TrainingStats
+    :type max_depth: int
+    :type min_samples_leaf: int
+    :type min_impurity_decrease: float
+    :type max_leaf_nodes: int
+    :type criterion: str | impurity.Criterion
+    :type feature_scope: str
+    :type cache_size: int
     """
-    def __init__(self, train_data, train_label, feature_dict_list, continuous_features, root=None, threshold=5):
+    def __init__(self, train_data, train_label, feature_dict_list, continuous_features, root=None, threshold=5,
+                 n_jobs=1, parallel_min_rows=100000, max_features=None, random_state=None, instrument=None,
+                 max_depth=None, min_samples_leaf=None, min_impurity_decrease=None, max_leaf_nodes=None,
+                 criterion='gini', cache_size=None, feature_scope='tree'):
         self.train_data = train_data
         self.train_label = train_label
         self.feature_dict_list = feature_dict_list
         self.continuous_features = continuous_features
-        self.root = root
+        # node arrays of a tree read by load, root is only built from them when needed
+        self.compiled = None
+        # set directly, there is no cache to clear yet
+        self._root = root
         self.threshold = threshold
+        self.n_jobs = n_jobs
+        self.parallel_min_rows = parallel_min_rows
+        self.max_features = max_features
+        self.rng = np.random.default_rng(random_state)
+        self.instrument = instrument
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.min_impurity_decrease = min_impurity_decrease
+        self.max_leaf_nodes = max_leaf_nodes
+        if feature_scope not in ('tree', 'path'):
+            raise ValueError("feature_scope %r is NOT supported (expected 'tree' or 'path')" % (feature_scope,))
+        self.feature_scope = feature_scope
+        self.criterion = get_criterion(criterion)
+        # labels are encode values of the label dictionary, the last of feature_dict_list
+        self.n_classes = len(feature_dict_list[-1])
+        # cleared whenever the tree changes
+        self.cache = None if cache_size is None else PredictionCache(cache_size)
+
+    @property
+    def root(self):
+        """ Root treenode, rebuilt from the node arrays of a loaded tree on first use """
+        if self._root is None and self.compiled is not None:
+            self._root = self.compiled.to_tree()
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._root = root
+        # a new tree, the cached predictions & the node arrays are of the old one
+        self.clear_cache()
 
     def check_data(self, data_list, label_list):
         """ Check data format of data_list & label_list
@@ -40,19 +120,20 @@ class DecisionTree:
         if len(data_list[0])+1 != len(self.feature_dict_list):
             raise ValueError("length of data_list does NOT match length of label_list")
 
-    def create_tree(self, data_list, label_list, attr_idx=-1, attr_val=-1, feature_idx_list=None):
-        """ Create decision tree recursively
+    def create_tree(self, data_list, label_list, feature_idx_list=None, sample_weight=None):
+        """ Create decision tree
+
+        The rows are converted to a matrix once, the tree is then grown on a
+        shared row index buffer by grow_tree.
 
         :param data_list: subset of training data
         :param label_list: subset of training label
-        :param attr_idx: attribute index of the split
-        :param attr_val: encode attribute value of the split
         :param feature_idx_list: list of feature indexes not split
-        :type data_list: List[List[int]]
-        :type label_list: [List[int]
-        :type attr_idx: int
-        :type attr_val: int
+        :param sample_weight: weight of each row in the class counts, None for 1
+        :type data_list: List[List[int]] | numpy.ndarray
+        :type label_list: List[int] | numpy.ndarray
         :type feature_idx_list: List[int]
+        :type sample_weight: List[float] | numpy.ndarray
         :return: treenode with subtrees
         :rtype: TreeNode
         """
@@ -62,58 +143,750 @@ class DecisionTree:
             print(str(e))
             return None
 
-        tree_node = TreeNode(attr_idx=attr_idx, attr_val=attr_val)
+        matrix = np.asarray(data_list)
+        columns = [matrix[:, i] for i in range(matrix.shape[1])]
+        weights = None
+        if sample_weight is not None:
+            # scaled to sum to the number of rows, so weighted shares of the rows match unweighted ones
+            weights = np.asarray(sample_weight, dtype=np.float64)
+            weights = weights * (len(weights) / weights.sum())
+        return self.grow_tree(columns, np.asarray(label_list), feature_idx_list, weights)
+
+    def grow_tree(self, columns, labels, feature_idx_list=None, weights=None):
+        """ Grow decision tree iteratively on a shared row index buffer
+
+        Each node owns the range [start, end) of the buffer. Splitting a node
+        partitions its range in place (stable, S1 first), so the training rows
+        are never copied and the nodes are visited in the same depth-first
+        order as a recursive build.
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param feature_idx_list: list of feature indexes not split
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type feature_idx_list: List[int]
+        :type weights: numpy.ndarray
+        :return: treenode with subtrees
+        :rtype: TreeNode
+        """
+        index = np.arange(len(labels), dtype=np.int32 if len(labels) < 2 ** 31 else np.int64)
+        root = TreeNode()
         # initialize root node for the first time
         if self.root is None:
-            self.root = tree_node
+            self.root = root
+
+        if self.n_jobs > 1 and len(labels) >= self.parallel_min_rows:
+            self.grow_nodes_parallel(columns, labels, index, root, feature_idx_list, weights)
+        else:
+            self.grow_nodes(columns, labels, index, root, feature_idx_list, weights=weights)
+        self.clear_cache()
+        return root
+
+    def grow_nodes(self, columns, labels, index, root, feature_idx_list, pool=None, weights=None, start=0, end=None,
+                   depth=0):
+        """ Grow the subtrees of root depth-first on the row index buffer
+
+        With max_leaf_nodes the subtrees are grown best-first by grow_nodes_best_first instead.
+        With a pool and feature_scope='path' the subtrees of the nodes with fewer
+        than parallel_min_rows rows are independent of each other, each is
+        grown whole by a worker process on its own range of the buffer.
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param index: row index buffer
+        :param root: treenode to grow
+        :param feature_idx_list: list of feature indexes not split
+        :param pool: worker processes attached to columns, labels & index by grow_nodes_parallel
+        :param weights: sample weight of each row, None for 1
+        :param start: start of the root range in the row index buffer
+        :param end: end of the root range in the row index buffer, None for the end of the buffer
+        :param depth: depth of root
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type index: numpy.ndarray
+        :type root: TreeNode
+        :type feature_idx_list: List[int]
+        :type pool: concurrent.futures.ProcessPoolExecutor
+        :type weights: numpy.ndarray
+        :type start: int
+        :type end: int
+        :type depth: int
+        """
+        if self.max_leaf_nodes is not None:
+            self.grow_nodes_best_first(columns, labels, index, root, feature_idx_list, pool, weights)
+            return
+        subtrees = []
+        stack = [(root, start, len(index) if end is None else end, depth, feature_idx_list)]
+        while stack:
+            tree_node, start, end, depth, node_idx_list = stack.pop()
+            if pool is not None and self.feature_scope == 'path' and end - start < self.parallel_min_rows:
+                seed = None if self.max_features is None else int(self.rng.integers(2 ** 32))
+                subtrees.append((tree_node, pool.submit(_grow_subtree_worker, start, end, depth, node_idx_list,
+                                                        seed, self.instrument is not None)))
+                continue
+            split = self.find_node_split(columns, labels, index, tree_node, start, end, depth, node_idx_list, pool,
+                                         weights)
+            if split is not None:
+                children = self.split_node(columns, labels, index, tree_node, start, end, depth, node_idx_list,
+                                           split, weights)
+                # push S2 first so that S1 is grown first
+                stack.extend(reversed(children))
+        for tree_node, future in subtrees:
+            subtree, records = future.result()
+            # the parent holds tree_node, so the grown subtree is copied into it
+            for name in TreeNode.__slots__:
+                setattr(tree_node, name, getattr(subtree, name))
+            for record in records or ():
+                self.instrument.on_node(record)
+
+    def grow_nodes_best_first(self, columns, labels, index, root, feature_idx_list, pool=None, weights=None):
+        """ Grow the subtrees of root best-first until the tree has max_leaf_nodes leaves
+
+        The node whose split decreases the impurity most is split first, the
+        nodes left when the tree is out of leaves become leaves. A node whose
+        split feature was taken by another node in the meantime searches its
+        split again.
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param index: row index buffer, root owns all of it
+        :param root: treenode to grow
+        :param feature_idx_list: list of feature indexes not split
+        :param pool: worker processes attached to columns, labels & index by grow_nodes_parallel
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type index: numpy.ndarray
+        :type root: TreeNode
+        :type feature_idx_list: List[int]
+        :type pool: concurrent.futures.ProcessPoolExecutor
+        :type weights: numpy.ndarray
+        """
+        heap = []
+        order = count()
+        n_leaves = 1
+        candidates = [(root, 0, len(index), 0, feature_idx_list)]
+        while True:
+            for tree_node, start, end, depth, node_idx_list in candidates:
+                split = self.find_node_split(columns, labels, index, tree_node, start, end, depth, node_idx_list,
+                                             pool, weights)
+                if split is not None:
+                    # largest impurity decrease first, ties in the order found
+                    heappush(heap, (-split[0], next(order), tree_node, start, end, depth, node_idx_list, split))
+            if not heap or n_leaves >= self.max_leaf_nodes:
+                break
+            _, _, tree_node, start, end, depth, node_idx_list, split = heappop(heap)
+            if split[1] in node_idx_list:
+                candidates = self.split_node(columns, labels, index, tree_node, start, end, depth, node_idx_list,
+                                             split, weights)
+                n_leaves += 1
+            else:
+                candidates = [(tree_node, start, end, depth, node_idx_list)]
 
+        for _, _, tree_node, start, end, depth, _, _ in heap:
+            rows = index[start:end]
+            majority = self.get_majority_label_vector(labels[rows], None if weights is None else weights[rows])
+            self.make_leaf(tree_node, majority, depth, end - start, 'max_leaf_nodes')
+
+    def find_node_split(self, columns, labels, index, tree_node, start, end, depth, feature_idx_list, pool=None,
+                        weights=None):
+        """ Returns the best split of a node, or makes the node a leaf when it should not be split
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param index: row index buffer
+        :param tree_node: treenode to split
+        :param start: start of the node range in the row index buffer
+        :param end: end of the node range in the row index buffer
+        :param depth: depth of the node
+        :param feature_idx_list: list of feature indexes not split
+        :param pool: worker processes attached to columns, labels & index by grow_nodes_parallel
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type index: numpy.ndarray
+        :type tree_node: TreeNode
+        :type start: int
+        :type end: int
+        :type depth: int
+        :type feature_idx_list: List[int]
+        :type pool: concurrent.futures.ProcessPoolExecutor
+        :type weights: numpy.ndarray
+        :returns: None for a leaf, otherwise impurity decrease, feature index & value of the split,
+                  scored feature indexes, search time & number of exactly scored splits for the instrument
+        :rtype: Tuple[float, int, int, List[int], float, int]
+        """
+        stats = self.instrument
+        rows = index[start:end]
+        node_labels = labels[rows]
+        node_weights = None if weights is None else weights[rows]
         # if all objects belong to the same class
-        only_label = self.is_same_class(label_list)
-        if only_label != -1:
-            tree_node.is_leaf = True
-            tree_node.result = only_label
-            return tree_node  # return a leaf node with the value of this class
+        if np.all(node_labels == node_labels[0]):
+            self.make_leaf(tree_node, int(node_labels[0]), depth, end - start, 'same_class')
+            return None
 
         # if all objects have the same attribute
         # or |S| is too small
-        if self.is_same_attribute(data_list) or len(label_list) < self.threshold:
-            tree_node.is_leaf = True
-            tree_node.result = self.get_majority_label(label_list)
-            return tree_node
-
-        # find the best split
-        # get feature index for next split
-        if len(feature_idx_list) == 0:
-            tree_node.is_leaf = True
-            tree_node.result = self.get_majority_label(label_list)
-            return tree_node
-        # find split with best GINI
-        best_attr_idx, best_attr_val = self.find_best_split(data_list, label_list, feature_idx_list)
-        feature_idx_list.remove(best_attr_idx)
-        # split into subset S1 and S2
+        # or the node is too deep
+        is_same_attribute = self.is_same_attribute_rows(columns, rows)
+        is_too_deep = self.max_depth is not None and depth >= self.max_depth
+        if is_same_attribute or len(rows) < self.threshold or len(feature_idx_list) == 0 or is_too_deep:
+            reason = 'same_attribute' if is_same_attribute else 'threshold' if len(rows) < self.threshold else \
+                'no_feature' if len(feature_idx_list) == 0 else 'max_depth'
+            self.make_leaf(tree_node, self.get_majority_label_vector(node_labels, node_weights), depth, end - start,
+                           reason)
+            return None
+
+        # find split with best impurity
+        if stats is not None:
+            split_start = perf_counter()
+        candidate_idx_list = self.sample_features(feature_idx_list)
+        if pool is not None and end - start >= self.parallel_min_rows:
+            best_impurity, best_attr_idx, best_attr_val, exact_splits = self.score_features_parallel(
+                pool, start, end, candidate_idx_list)
+        else:
+            best_impurity, best_attr_idx, best_attr_val, exact_splits = self.score_features(
+                columns, labels, rows, candidate_idx_list, weights)
+        split_seconds = 0.0
+        scored_idx_list = None
+        if stats is not None:
+            split_seconds = perf_counter() - split_start
+            # without max_features the candidates are feature_idx_list itself, which is changed by split_node
+            scored_idx_list = list(candidate_idx_list)
+        # no split improves impurity
+        if best_attr_idx == -1:
+            self.make_leaf(tree_node, self.get_majority_label_vector(node_labels, node_weights), depth, end - start,
+                           'no_gain', scored_idx_list, split_seconds, exact_splits)
+            return None
+
+        # decrease of impurity weighted by the share of the training rows in the node
+        gain = 0.0
+        if self.min_impurity_decrease is not None or self.max_leaf_nodes is not None:
+            total = self.count_classes(node_labels, node_weights)
+            impurity = self.criterion.node_impurity(total.tolist())
+            # weights sum to the number of rows
+            gain = total.sum() / len(index) * (impurity - best_impurity)
+            if self.min_impurity_decrease is not None and gain < self.min_impurity_decrease:
+                self.make_leaf(tree_node, self.get_majority_label_vector(node_labels, node_weights), depth,
+                               end - start, 'min_impurity_decrease', scored_idx_list, split_seconds, exact_splits)
+                return None
+        return gain, best_attr_idx, best_attr_val, scored_idx_list, split_seconds, exact_splits
+
+    def split_node(self, columns, labels, index, tree_node, start, end, depth, feature_idx_list, split, weights=None):
+        """ Split a node and partition its range of the row index buffer between its children
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param index: row index buffer
+        :param tree_node: treenode to split
+        :param start: start of the node range in the row index buffer
+        :param end: end of the node range in the row index buffer
+        :param depth: depth of the node
+        :param feature_idx_list: list of feature indexes not split
+        :param split: split found by find_node_split
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type index: numpy.ndarray
+        :type tree_node: TreeNode
+        :type start: int
+        :type end: int
+        :type depth: int
+        :type feature_idx_list: List[int]
+        :type split: Tuple[float, int, int, List[int], float, int]
+        :type weights: numpy.ndarray
+        :returns: treenode, start, end, depth & feature indexes not split of the children to grow, S1 first
+        :rtype: List[Tuple[TreeNode, int, int, int, List[int]]]
+        """
+        stats = self.instrument
+        _, best_attr_idx, best_attr_val, scored_idx_list, split_seconds, exact_splits = split
+        rows = index[start:end]
+        majority = self.get_majority_label_vector(labels[rows], None if weights is None else weights[rows])
+        if self.feature_scope == 'tree':
+            feature_idx_list.remove(best_attr_idx)
+        else:  # the children get their own list, the other nodes keep the feature
+            feature_idx_list = [idx for idx in feature_idx_list if idx != best_attr_idx]
+        # partition [start, end) into S1 [start, mid) and S2 [mid, end)
+        if stats is not None:
+            partition_start = perf_counter()
         if best_attr_idx in self.continuous_features:
-            data_list1, label_list1, data_list2, label_list2 = self.split_dataset(
-                data_list, label_list, best_attr_idx, best_attr_val, is_continuous=True)
+            mask = columns[best_attr_idx][rows] <= best_attr_val
+        else:
+            mask = columns[best_attr_idx][rows] == best_attr_val
+        mid = start + int(np.count_nonzero(mask))
+        rows[:] = np.concatenate((rows[mask], rows[~mask]))
+
+        tree_node.result = majority
+        tree_node.attr_idx = best_attr_idx
+        tree_node.attr_val = best_attr_val
+        tree_node.true_brunch = TreeNode()
+        tree_node.false_brunch = TreeNode()
+        if stats is not None:
+            self.record_node(stats, tree_node, depth, end - start, None, scored_idx_list, split_seconds,
+                             perf_counter() - partition_start, exact_splits)
+        children = []
+        for child, child_start, child_end in ((tree_node.true_brunch, start, mid),
+                                              (tree_node.false_brunch, mid, end)):
+            if child_end > child_start:
+                children.append((child, child_start, child_end, depth + 1, feature_idx_list))
+            else:  # subset is empty
+                self.make_leaf(child, majority, depth + 1, 0, 'empty')
+        return children
+
+    def make_leaf(self, tree_node, result, depth, n_rows, leaf_reason, scored_idx_list=None, split_seconds=0.0,
+                  exact_splits=0):
+        """ Make a node a leaf
+
+        :param tree_node: treenode
+        :param result: label of the leaf
+        :param depth: depth of the node
+        :param n_rows: number of training rows of the node
+        :param leaf_reason: why the node is a leaf, for the instrument
+        :param scored_idx_list: features scored by the split search, for the instrument
+        :param split_seconds: time of the split search, for the instrument
+        :param exact_splits: number of splits scored exactly by the split search, for the instrument
+        :type tree_node: TreeNode
+        :type result: int
+        :type depth: int
+        :type n_rows: int
+        :type leaf_reason: str
+        :type scored_idx_list: List[int]
+        :type split_seconds: float
+        :type exact_splits: int
+        """
+        tree_node.is_leaf = True
+        tree_node.result = result
+        if self.instrument is not None:
+            self.record_node(self.instrument, tree_node, depth, n_rows, leaf_reason, scored_idx_list or (),
+                             split_seconds, exact_splits=exact_splits)
+
+    def record_node(self, stats, tree_node, depth, n_rows, leaf_reason, candidate_idx_list=(), split_seconds=0.0,
+                    partition_seconds=0.0, exact_splits=0):
+        """ Pass the statistics of a grown node to the instrument
+
+        Every candidate split is estimated at once by score_histogram, only
+        the exact_splits closest to the best are scored by the criterion.
+
+        :param stats: instrument of the tree
+        :param tree_node: grown treenode
+        :param depth: depth of the node
+        :param n_rows: number of training rows of the node
+        :param leaf_reason: why the node is a leaf, None for split node
+        :param candidate_idx_list: features scored by the split search
+        :param split_seconds: time of the split search
+        :param partition_seconds: time of partitioning the rows
+        :param exact_splits: number of splits scored exactly by the split search
+        :type stats: instrumentation.TrainingStats
+        :type tree_node: TreeNode
+        :type depth: int
+        :type n_rows: int
+        :type leaf_reason: str
+        :type candidate_idx_list: List[int]
+        :type split_seconds: float
+        :type partition_seconds: float
+        :type exact_splits: int
+        """
+        candidate_splits = 0
+        for feature_idx in candidate_idx_list:
+            # the last value of a continuous feature is no split
+            candidate_splits += len(self.feature_dict_list[feature_idx]) - (feature_idx in self.continuous_features)
+        stats.on_node({
+            'depth': depth,
+            'n_rows': n_rows,
+            'is_leaf': tree_node.is_leaf,
+            'leaf_reason': leaf_reason,
+            'attr_idx': tree_node.attr_idx,
+            'attr_val': tree_node.attr_val,
+            'n_features': len(candidate_idx_list),
+            'candidate_splits': candidate_splits,
+            'exact_splits': exact_splits,
+            'find_best_split_seconds': split_seconds,
+            'split_dataset_seconds': partition_seconds,
+        })
+
+    def grow_nodes_parallel(self, columns, labels, index, root, feature_idx_list, weights=None):
+        """ Grow the subtrees of root with the split search of large nodes in worker processes
+
+        The matrix, the labels, the weights and the row index buffer are moved to shared
+        memory, the workers read the rows of a node from the buffer and each
+        scores a chunk of the features of a node with at least
+        parallel_min_rows rows. With feature_scope='path' the subtrees of the
+        smaller nodes are grown whole by the workers, see grow_nodes. With
+        feature_scope='tree' they are grown in the main process, because the
+        features split on the true branch are removed from feature_idx_list
+        before the false branch is grown.
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param index: row index buffer, root owns all of it
+        :param root: treenode to grow
+        :param feature_idx_list: list of feature indexes not split
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type index: numpy.ndarray
+        :type root: TreeNode
+        :type feature_idx_list: List[int]
+        :type weights: numpy.ndarray
+        """
+        shared_matrix = SharedArray((len(labels), len(columns)), np.result_type(*columns), order='F')
+        for i, column in enumerate(columns):
+            shared_matrix.array[:, i] = column
+        shared_list = [shared_matrix, SharedArray.copy_of(labels), SharedArray.copy_of(index)]
+        if weights is not None:
+            shared_list.append(SharedArray.copy_of(weights))
+        try:
+            specs = [shared.spec() for shared in shared_list]
+            with ProcessPoolExecutor(self.n_jobs, initializer=_init_split_worker,
+                                     initargs=(specs, self.feature_dict_list, self.continuous_features, {
+                                         'threshold': self.threshold,
+                                         'max_features': self.max_features,
+                                         'max_depth': self.max_depth,
+                                         'min_samples_leaf': self.min_samples_leaf,
+                                         'min_impurity_decrease': self.min_impurity_decrease,
+                                         'criterion': self.criterion,
+                                         'feature_scope': self.feature_scope,
+                                     })) as pool:
+                self.grow_nodes([shared_matrix.array[:, i] for i in range(len(columns))], shared_list[1].array,
+                                shared_list[2].array, root, feature_idx_list, pool,
+                                None if weights is None else shared_list[3].array)
+        finally:
+            for shared in shared_list:
+                shared.close()
+
+    def prune(self, data_list, label_list):
+        """ Reduced-error pruning of the tree against validation rows
+
+        The validation rows are routed through the tree, then bottom-up every
+        split node becomes a leaf labelled with its majority training label
+        when that misclassifies no more validation rows than its subtree. A
+        split node without a label (e.g. of a model file of the first version)
+        takes the majority of its validation rows.
+
+        :param data_list: validation data, not used for training
+        :param label_list: validation label
+        :type data_list: List[List[int]] | numpy.ndarray
+        :type label_list: List[int] | numpy.ndarray
+        :return: root treenode
+        :rtype: TreeNode
+        """
+        matrix = np.asarray(data_list)
+        labels = np.asarray(label_list)
+        if self.root is None:
+            return None
+        # nodes in pre-order with their validation rows
+        node_rows = []
+        stack = [(self.root, np.arange(len(labels)))]
+        while stack:
+            node, rows = stack.pop()
+            node_rows.append((node, rows))
+            if not node.is_leaf:
+                mask = self.split_mask(node, matrix[rows, node.attr_idx])
+                for child, child_rows in ((node.false_brunch, rows[~mask]), (node.true_brunch, rows[mask])):
+                    if child is not None:
+                        stack.append((child, child_rows))
+
+        # children come before their parent in reverse pre-order
+        errors = {}
+        for node, rows in reversed(node_rows):
+            node_labels = labels[rows]
+            if node.is_leaf:
+                errors[node] = int(np.count_nonzero(node_labels != node.result))
+                continue
+            subtree_errors = errors.pop(node.true_brunch, 0) + errors.pop(node.false_brunch, 0)
+            if node.result == -1:
+                if len(rows) == 0:
+                    errors[node] = subtree_errors
+                    continue
+                node.result = self.get_majority_label_vector(node_labels)
+            leaf_errors = int(np.count_nonzero(node_labels != node.result))
+            if leaf_errors <= subtree_errors:
+                node.is_leaf = True
+                node.attr_idx = -1
+                node.attr_val = -1
+                node.true_brunch = None
+                node.false_brunch = None
+                errors[node] = leaf_errors
+            else:
+                errors[node] = subtree_errors
+        self.clear_cache()
+        return self.root
+
+    def init_stats(self, data_list, label_list, sample_weight=None):
+        """ Collect the class-count statistics of every node from the training rows of the tree
+
+        The tree is not changed. Call it once after create_tree, so that update
+        refines the tree with the statistics of all rows seen so far.
+
+        :param data_list: training data of the tree
+        :param label_list: training label of the tree
+        :param sample_weight: weight of each row in the class counts, None for 1
+        :type data_list: List[List[int]] | numpy.ndarray
+        :type label_list: List[int] | numpy.ndarray
+        :type sample_weight: List[float] | numpy.ndarray
+        """
+        matrix = np.asarray(data_list)
+        labels = np.asarray(label_list)
+        weights = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        stack = [(self.root, np.arange(len(labels)))]
+        while stack:
+            node, rows = stack.pop()
+            node.stats = self.new_stats()
+            node.row_stats = np.zeros(len(node.stats), dtype=np.int64)
+            self.count_stats(node.stats, matrix, labels, rows, weights, node.row_stats)
+            if not node.is_leaf:
+                mask = self.split_mask(node, matrix[rows, node.attr_idx])
+                stack.append((node.false_brunch, rows[~mask]))
+                stack.append((node.true_brunch, rows[mask]))
+
+    def update(self, data_list, label_list, feature_idx_list=None, delta=1e-7, tie_threshold=0.05,
+               sample_weight=None):
+        """ Update the tree incrementally with a batch of new rows, in the style of a Hoeffding tree
+
+        Every node keeps the class-count histograms of the rows that reached it
+        in TreeNode.stats. The batch is routed down the tree and added to the
+        histograms on its way, then each node it reaches is checked:
+
+        * a leaf is split when the best split of its histograms is better than
+          the best split of any other feature by the Hoeffding bound
+          sqrt(R^2 ln(1/delta) / 2n), R the largest impurity of the criterion,
+          or when the bound is below tie_threshold
+        * a split node whose best split is now better than its own split by
+          the Hoeffding bound is re-grown: its subtree is replaced by the new
+          split with two new leaves
+
+        The batch rows go on into the new leaves, so an update costs time
+        proportional to the batch and the depth of the tree, not to all the
+        rows seen before. A feature is split at most once per path. Nodes
+        without statistics, e.g. of a tree grown by create_tree without
+        init_stats, start counting from zero. Sample weights only weight the
+        class counts, n of the bound, threshold and min_samples_leaf count
+        rows, as in create_tree.
+
+        :param data_list: new data
+        :param label_list: new label
+        :param feature_idx_list: list of feature indexes to split on, None for all
+        :param delta: probability that a split chosen by the bound is not the best
+        :param tie_threshold: split anyway when the bound is below this
+        :param sample_weight: weight of each new row in the class counts, None for 1
+        :type data_list: List[List[int]] | numpy.ndarray
+        :type label_list: List[int] | numpy.ndarray
+        :type feature_idx_list: List[int]
+        :type delta: float
+        :type tie_threshold: float
+        :type sample_weight: List[float] | numpy.ndarray
+        :return: root treenode
+        :rtype: TreeNode
+        """
+        try:
+            self.check_data(data_list, label_list)
+        except Exception as e:
+            print(str(e))
+            return None
+
+        matrix = np.asarray(data_list)
+        labels = np.asarray(label_list)
+        weights = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        if feature_idx_list is None:
+            feature_idx_list = list(range(matrix.shape[1]))
+        if self.root is None:
+            self.root = TreeNode(is_leaf=True, result=0)
+        stack = [(self.root, np.arange(len(labels)), ())]
+        while stack:
+            node, rows, used_idx = stack.pop()
+            if node.stats is None:
+                node.stats = self.new_stats()
+                node.row_stats = np.zeros(len(node.stats), dtype=np.int64)
+            self.count_stats(node.stats, matrix, labels, rows, weights, node.row_stats)
+            if node.is_leaf:
+                node.result = self.get_majority_label_counts(self.stats_counts(node.stats), node.result)
+            candidate_idx_list = [idx for idx in feature_idx_list if idx not in used_idx]
+            self.refine_node(node, candidate_idx_list, delta, tie_threshold)
+            if node.is_leaf:
+                continue
+            mask = self.split_mask(node, matrix[rows, node.attr_idx])
+            used_idx += (node.attr_idx,)
+            # only the nodes the batch reaches are counted & refined, as in route_batch
+            if not np.all(mask):
+                stack.append((node.false_brunch, rows[~mask], used_idx))
+            if np.any(mask):
+                stack.append((node.true_brunch, rows[mask], used_idx))
+        self.clear_cache()
+        return self.root
+
+    def refine_node(self, node, feature_idx_list, delta, tie_threshold):
+        """ Split a leaf, or re-grow a split node, when its statistics show a better split
+
+        :param node: treenode with statistics
+        :param feature_idx_list: list of feature indexes not split on the path to node
+        :param delta: probability that a split chosen by the bound is not the best
+        :param tie_threshold: split a leaf anyway when the bound is below this
+        :type node: TreeNode
+        :type feature_idx_list: List[int]
+        :type delta: float
+        :type tie_threshold: float
+        """
+        total = self.stats_counts(node.stats)
+        # number of rows, the class counts are sums of weights with sample weights
+        s = self.stats_counts(node.row_stats)
+        if np.count_nonzero(total) <= 1 or s < self.threshold or len(feature_idx_list) == 0:
+            return
+        scores = []
+        for feature_idx in self.sample_features(feature_idx_list):
+            val_counts = self.stats_histogram(node.stats, feature_idx)
+            val_rows = self.stats_histogram(node.row_stats, feature_idx)
+            impurity, feature_val, _ = self.score_histogram(feature_idx, val_counts, total, val_rows)
+            scores.append((impurity, feature_val, feature_idx))
+        # the first feature wins ties, the same as find_best_split
+        best_impurity, best_val, best_idx = min(scores, key=itemgetter(0))
+        if best_val == -1:  # no split improves impurity
+            return
+        max_impurity = self.criterion.max_impurity(self.n_classes)
+        epsilon = max_impurity * np.sqrt(np.log(1 / delta) / (2 * s))
+        if node.is_leaf:
+            other_impurity = min((impurity for impurity, _, feature_idx in scores if feature_idx != best_idx),
+                                 default=max_impurity)
+            if other_impurity - best_impurity <= epsilon and epsilon >= tie_threshold:
+                return
+        else:
+            if (node.attr_idx, node.attr_val) == (best_idx, best_val):
+                return
+            other_impurity = self.stats_split_impurity(node.stats, node.attr_idx, node.attr_val, total)
+            if other_impurity - best_impurity <= epsilon:
+                return
+
+        majority = self.get_majority_label_counts(total, node.result if node.is_leaf else 0)
+        node.is_leaf = False
+        node.result = majority
+        node.attr_idx = best_idx
+        node.attr_val = best_val
+        node.true_brunch = TreeNode(is_leaf=True, result=majority)
+        node.false_brunch = TreeNode(is_leaf=True, result=majority)
+
+    def new_stats(self):
+        """ Returns empty class-count statistics of a node
+
+        :return: class counts of every attribute value, indexed by [stats_offsets()[attribute] + value, label]
+        :rtype: numpy.ndarray
+        """
+        return np.zeros((self.stats_offsets()[-1], self.n_classes), dtype=np.float64)
+
+    def stats_offsets(self):
+        """ Returns where the values of each attribute start in the statistics of a node
+
+        The attributes are stored one after another, so continuous attributes
+        with many values do not pad the others.
+
+        :return: offset of each attribute, then the number of values of all attributes
+        :rtype: numpy.ndarray
+        """
+        return np.cumsum([0] + [len(d) for d in self.feature_dict_list[:-1]])
+
+    def count_stats(self, stats, matrix, labels, rows, weights=None, row_stats=None):
+        """ Add rows to the class-count statistics of a node
+
+        :param stats: statistics of the node
+        :param matrix: encode attribute matrix
+        :param labels: encode label vector
+        :param rows: row indexes reaching the node
+        :param weights: sample weight of each row, None for 1
+        :param row_stats: number of rows of every attribute value of the node, None to not count them
+        :type stats: numpy.ndarray
+        :type matrix: numpy.ndarray
+        :type labels: numpy.ndarray
+        :type rows: numpy.ndarray
+        :type weights: numpy.ndarray
+        :type row_stats: numpy.ndarray
+        """
+        offsets = self.stats_offsets()
+        n_attrs = len(offsets) - 1
+        # one bincount over all attributes & labels
+        flat = ((matrix[rows].astype(np.intp) + offsets[:-1]) * self.n_classes + labels[rows, None]).ravel()
+        if weights is None:
+            counts = np.bincount(flat, minlength=stats.size).reshape(stats.shape)
+            stats += counts
+            if row_stats is not None:
+                row_stats += counts.sum(axis=1).astype(np.int64)
+            return
+        stats += np.bincount(flat, np.repeat(weights[rows], n_attrs), minlength=stats.size).reshape(stats.shape)
+        if row_stats is not None:
+            row_stats += np.bincount(flat // self.n_classes, minlength=len(row_stats))
+
+    def stats_counts(self, stats):
+        """ Returns the class counts of a node from its statistics, or its number of rows from its row_stats
+
+        :param stats: statistics of the node
+        :type stats: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        return stats[:self.stats_offsets()[1]].sum(axis=0)
+
+    def stats_histogram(self, stats, feature_idx):
+        """ Returns the histogram of an attribute from the statistics of a node, as build_histogram
+
+        :param stats: statistics of the node, or its row_stats for the number of rows
+        :param feature_idx: attribute index
+        :type stats: numpy.ndarray
+        :type feature_idx: int
+        :return: class counts of each encode attribute value
+        :rtype: numpy.ndarray
+        """
+        offset = self.stats_offsets()[feature_idx]
+        return stats[offset:offset + len(self.feature_dict_list[feature_idx])]
+
+    def stats_split_impurity(self, stats, attr_idx, attr_val, total):
+        """ Returns the impurity of a split from the statistics of a node
+
+        :param stats: statistics of the node
+        :param attr_idx: attribute index of the split
+        :param attr_val: attribute value of the split
+        :param total: class counts of the node
+        :type stats: numpy.ndarray
+        :type attr_idx: int
+        :type attr_val: int
+        :type total: numpy.ndarray
+        :rtype: float
+        """
+        offset = self.stats_offsets()[attr_idx]
+        if attr_idx in self.continuous_features:
+            counts1 = stats[offset:offset + attr_val + 1].sum(axis=0)
         else:
-            data_list1, label_list1, data_list2, label_list2 = self.split_dataset(
-                data_list, label_list, best_attr_idx, best_attr_val, is_continuous=False)
-
-        # create tree for S1 and S2
-        if len(data_list1) > 0:  # get subtree
-            tree_node.true_brunch = self.create_tree(data_list1, label_list1, best_attr_idx, best_attr_val, feature_idx_list)
-        else:  # s1 is empty
-            result = self.get_majority_label(label_list)
-            tree_node.true_brunch = TreeNode(is_leaf=True, result=result, attr_idx=best_attr_idx, attr_val=best_attr_val)
-        if len(data_list2) > 0:  # get subtree
-            tree_node.false_brunch = self.create_tree(data_list2, label_list2, best_attr_idx, -1, feature_idx_list)
-        else:  # s2 is empty
-            result = self.get_majority_label(label_list)
-            tree_node.false_brunch = TreeNode(is_leaf=True, result=result, attr_idx=best_attr_idx, attr_val=-1)
-
-        return tree_node
+            counts1 = stats[offset + attr_val]
+        return self.criterion.split_impurity(counts1.tolist(), (total - counts1).tolist())
+
+    def split_mask(self, node, values):
+        """ Returns which values go to the true branch of a split node
+
+        :param node: split treenode
+        :param values: values of the split attribute
+        :type node: TreeNode
+        :type values: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        if node.attr_idx in self.continuous_features:
+            return values <= node.attr_val
+        return values == node.attr_val
+
+    def sample_features(self, feature_idx_list):
+        """ Returns the split candidates of a node, max_features of the features not split
+
+        :param feature_idx_list: list of feature indexes not split
+        :type feature_idx_list: List[int]
+        :return: sampled feature indexes in the order of feature_idx_list
+        :rtype: List[int]
+        """
+        if self.max_features is None or self.max_features >= len(feature_idx_list):
+            return feature_idx_list
+        picked = self.rng.choice(len(feature_idx_list), self.max_features, replace=False)
+        return [feature_idx_list[i] for i in sorted(picked)]
 
     def find_best_split(self, data_list, label_list, feature_idx_list):
-        """ Returns the best split by GINI index
+        """ Returns the best split by the impurity criterion
+
+        The rows are counted once per feature into a class-count histogram,
+        every candidate split is then scored from the histogram counts.
 
         :param data_list: subset of training data
         :param label_list: subset of training label
@@ -124,42 +897,215 @@ class DecisionTree:
         :returns: split feature index and value of the best split
         :rtype: int, int
         """
-        best_gini = 0.5
+        total = np.zeros(self.n_classes, dtype=np.int64)
+        for label, cnt in Counter(label_list).items():
+            total[label] = cnt
+        best_impurity = self.criterion.max_impurity(self.n_classes)
         best_feature_idx = -1
         best_feature_val = -1
         for feature_idx in feature_idx_list:
-            feature_dict = self.feature_dict_list[feature_idx]
-            min_gini = 0.5
-            feature_val = -1
-            if feature_idx in self.continuous_features:  # continuous features
-                dict_len = len(feature_dict)
-                cnt = 0
-                for val in feature_dict.keys():
-                    if cnt == dict_len - 1:  # last val no need to split
-                        break
-                    cnt += 1
-                    data_list1, label_list1, data_list2, label_list2 = self.split_dataset(
-                        data_list, label_list, feature_idx, val, is_continuous=True)
-                    gini = self.cal_split_gini(data_list1, label_list1, data_list2, label_list2)
-                    if gini < min_gini:
-                        min_gini = gini
-                        feature_val = val
-            else:   # category features
-                for val in feature_dict.keys():
-                    data_list1, label_list1, data_list2, label_list2 = self.split_dataset(
-                        data_list, label_list, feature_idx, val, is_continuous=False)
-                    gini = self.cal_split_gini(data_list1, label_list1, data_list2, label_list2)
-                    if gini < min_gini:
-                        min_gini = gini
-                        feature_val = val
-            if min_gini < best_gini:
-                best_gini = min_gini
+            histogram = self.build_histogram(data_list, label_list, feature_idx)
+            min_impurity, feature_val, _ = self.score_histogram(feature_idx, histogram, total)
+            if min_impurity < best_impurity:
+                best_impurity = min_impurity
                 best_feature_idx = feature_idx
                 best_feature_val = feature_val
-        # print("best gini = " + str(best_gini) + " best_feature_idx = " + str(best_feature_idx) +
-        #       " best_feature_val = " + str(best_feature_val))
         return best_feature_idx, best_feature_val
 
+    def find_best_split_rows(self, columns, labels, rows, feature_idx_list, weights=None):
+        """ Returns the best split by the impurity criterion in columnar mode
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param rows: row indexes of the subset
+        :param feature_idx_list: list of feature indexes not split
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type rows: numpy.ndarray
+        :type feature_idx_list: List[int]
+        :type weights: numpy.ndarray
+        :returns: split feature index and value of the best split
+        :rtype: int, int
+        """
+        _, best_feature_idx, best_feature_val, _ = self.score_features(columns, labels, rows, feature_idx_list,
+                                                                       weights)
+        return best_feature_idx, best_feature_val
+
+    def score_features(self, columns, labels, rows, feature_idx_list, weights=None):
+        """ Returns the best split of some features by the impurity criterion in columnar mode
+
+        :param columns: columns of the encode attribute matrix
+        :param labels: encode label vector
+        :param rows: row indexes of the subset
+        :param feature_idx_list: list of feature indexes to score
+        :param weights: sample weight of each row, None for 1
+        :type columns: List[numpy.ndarray]
+        :type labels: numpy.ndarray
+        :type rows: numpy.ndarray
+        :type feature_idx_list: List[int]
+        :type weights: numpy.ndarray
+        :returns: impurity, split feature index and value of the best split, number of splits scored exactly
+        :rtype: float, int, int, int
+        """
+        node_labels = labels[rows]
+        node_weights = None if weights is None else weights[rows]
+        total = self.count_classes(node_labels, node_weights)
+        best_impurity = self.criterion.max_impurity(self.n_classes)
+        best_feature_idx = -1
+        best_feature_val = -1
+        exact_splits = 0
+        for feature_idx in feature_idx_list:
+            column = columns[feature_idx][rows]
+            histogram = self.build_histogram_rows(feature_idx, column, node_labels, node_weights)
+            val_rows = None
+            if node_weights is not None and self.min_samples_leaf:
+                # min_samples_leaf counts rows, not weights
+                val_rows = np.bincount(column, minlength=len(histogram))
+            min_impurity, feature_val, n_exact = self.score_histogram(feature_idx, histogram, total, val_rows)
+            exact_splits += n_exact
+            if min_impurity < best_impurity:
+                best_impurity = min_impurity
+                best_feature_idx = feature_idx
+                best_feature_val = feature_val
+        return best_impurity, best_feature_idx, best_feature_val, exact_splits
+
+    def score_features_parallel(self, pool, start, end, feature_idx_list):
+        """ Returns the best split of some features by the impurity criterion, scored by the worker processes
+
+        :param pool: worker processes started by grow_nodes_parallel
+        :param start: start of the node range in the row index buffer
+        :param end: end of the node range in the row index buffer
+        :param feature_idx_list: list of feature indexes to score
+        :type pool: concurrent.futures.ProcessPoolExecutor
+        :type start: int
+        :type end: int
+        :type feature_idx_list: List[int]
+        :returns: impurity, split feature index and value of the best split, number of splits scored exactly
+        :rtype: float, int, int, int
+        """
+        n_chunks = min(self.n_jobs, len(feature_idx_list))
+        chunk_size = -(-len(feature_idx_list) // n_chunks)
+        futures = [pool.submit(_score_features_worker, start, end, feature_idx_list[i:i + chunk_size])
+                   for i in range(0, len(feature_idx_list), chunk_size)]
+        best_impurity = self.criterion.max_impurity(self.n_classes)
+        best_feature_idx = -1
+        best_feature_val = -1
+        exact_splits = 0
+        # chunks are merged in feature order, so ties resolve as in the serial search
+        for future in futures:
+            impurity, feature_idx, feature_val, n_exact = future.result()
+            exact_splits += n_exact
+            if impurity < best_impurity:
+                best_impurity = impurity
+                best_feature_idx = feature_idx
+                best_feature_val = feature_val
+        return best_impurity, best_feature_idx, best_feature_val, exact_splits
+
+    def score_histogram(self, feature_idx, histogram, total, val_rows=None):
+        """ Returns the best split of an attribute by the impurity criterion
+
+        The class counts of subset1 of all the candidate splits are taken at
+        once, for a continuous attribute as cumulative sums over the values
+        <= val. Their impurities are estimated without rounding, and only the
+        splits within ROUNDING_ERROR of the best estimate are scored exactly
+        in dictionary order, so the result is the same as scoring every split
+        exactly. The encode values of a continuous attribute must be ordered
+        like the attribute values.
+
+        :param feature_idx: attribute index
+        :param histogram: class counts of each encode attribute value
+        :param total: class counts of the subset
+        :param val_rows: number of rows of each encode attribute value for
+            min_samples_leaf, None if the class counts are numbers of rows
+        :type feature_idx: int
+        :type histogram: numpy.ndarray
+        :type total: numpy.ndarray
+        :type val_rows: numpy.ndarray
+        :returns: impurity and value of the best split, number of splits scored exactly
+        :rtype: float, int, int
+        """
+        feature_dict = self.feature_dict_list[feature_idx]
+        min_leaf = self.min_samples_leaf or 0
+        min_impurity = self.criterion.max_impurity(self.n_classes)
+        feature_val = -1
+        vals = np.fromiter(feature_dict.keys(), dtype=np.intp, count=len(feature_dict))
+        if feature_idx in self.continuous_features:
+            vals = vals[:-1]  # last val no need to split
+            counts1 = np.cumsum(histogram, axis=0)[vals]
+            rows1 = None if val_rows is None else np.cumsum(val_rows)[vals]
+        else:  # category features
+            counts1 = histogram[vals]
+            rows1 = None if val_rows is None else val_rows[vals]
+        if len(vals) == 0:
+            return min_impurity, feature_val, 0
+        counts2 = total - counts1
+
+        estimate = self.criterion.estimate_split(counts1, counts2)
+        if min_leaf:
+            if rows1 is None:
+                rows1 = counts1.sum(axis=1)
+                rows2 = total.sum() - rows1
+            else:
+                rows2 = val_rows.sum() - rows1
+            estimate[(rows1 < min_leaf) | (rows2 < min_leaf)] = np.inf
+        if not np.isfinite(estimate.min()):
+            return min_impurity, feature_val, 0
+        exact = np.flatnonzero(estimate <= estimate.min() + ROUNDING_ERROR).tolist()
+        for i in exact:
+            impurity = self.criterion.split_impurity(counts1[i].tolist(), counts2[i].tolist())
+            if impurity < min_impurity:
+                min_impurity = impurity
+                feature_val = int(vals[i])
+        return min_impurity, feature_val, len(exact)
+
+    def build_histogram(self, data_list, label_list, attr_idx):
+        """ Count the rows of every label and every value of an attribute
+
+        :param data_list: subset of training data
+        :param label_list: subset of training label
+        :param attr_idx: attribute index
+        :type data_list: List[List[int]]
+        :type label_list: List[int]
+        :type attr_idx: int
+        :return: class counts of each encode attribute value
+        :rtype: numpy.ndarray
+        """
+        histogram = np.zeros((len(self.feature_dict_list[attr_idx]), self.n_classes), dtype=np.int64)
+        for (val, label), cnt in Counter(zip(map(itemgetter(attr_idx), data_list), label_list)).items():
+            histogram[val, label] = cnt
+        return histogram
+
+    def build_histogram_rows(self, attr_idx, column, label_vector, weights=None):
+        """ Count the rows of every label and every value of an attribute in columnar mode
+
+        :param attr_idx: attribute index
+        :param column: attribute values of the subset
+        :param label_vector: labels of the subset
+        :param weights: sample weights of the subset, None for 1
+        :type attr_idx: int
+        :type column: numpy.ndarray
+        :type label_vector: numpy.ndarray
+        :type weights: numpy.ndarray
+        :return: class counts of each encode attribute value, sums of weights if weighted
+        :rtype: numpy.ndarray
+        """
+        n_vals = len(self.feature_dict_list[attr_idx])
+        flat = column.astype(np.intp) * self.n_classes + label_vector
+        return np.bincount(flat, weights, minlength=n_vals * self.n_classes).reshape(n_vals, self.n_classes)
+
+    def count_classes(self, label_vector, weights=None):
+        """ Count the rows of every label
+
+        :param label_vector: subset of training label
+        :param weights: sample weights of the subset, None for 1
+        :type label_vector: numpy.ndarray
+        :type weights: numpy.ndarray
+        :return: class counts of the subset, sums of weights if weighted
+        :rtype: numpy.ndarray
+        """
+        return np.bincount(label_vector, weights, minlength=self.n_classes)
+
     @staticmethod
     def is_same_class(label_list):
         """ Check if labels belong to the same class
@@ -195,10 +1141,63 @@ class DecisionTree:
 
         :param label_list: subset of training label
         :type label_list: List[int]
-        :return: label that appear most frequently
+        :return: label that appear most frequently, the first one on a tie
+        :rtype: int
+        """
+        # a Counter keeps the labels in order of first appearance
+        return Counter(label_list).most_common(1)[0][0]
+
+    @staticmethod
+    def is_same_attribute_rows(columns, rows):
+        """ Check if all data have the same attributes in columnar mode
+
+        :param columns: columns of the encode attribute matrix
+        :param rows: row indexes of the subset
+        :type columns: List[numpy.ndarray]
+        :type rows: numpy.ndarray
+        :rtype: bool
+        """
+        for column in columns:
+            values = column[rows]
+            if not np.all(values == values[0]):
+                return False
+        return True
+
+    @staticmethod
+    def get_majority_label_vector(label_vector, weights=None):
+        """ Returns the majority label of a label vector
+
+        Ties go to the label that appears first, the same as get_majority_label.
+
+        :param label_vector: subset of training label
+        :param weights: sample weights of the subset, None for 1
+        :type label_vector: numpy.ndarray
+        :type weights: numpy.ndarray
+        :return: label with the most rows, or the largest sum of weights
+        :rtype: int
+        """
+        counts = np.bincount(label_vector, weights)
+        majority = np.flatnonzero(counts == counts.max())
+        if len(majority) == 1:
+            return int(majority[0])
+        first = [np.argmax(label_vector == label) for label in majority]
+        return int(majority[np.argmin(first)])
+
+    @staticmethod
+    def get_majority_label_counts(counts, tie_label):
+        """ Returns the majority label of a subset from its class counts
+
+        :param counts: class counts of the subset
+        :param tie_label: label returned on a tie if it is one of the majority
+        :type counts: numpy.ndarray
+        :type tie_label: int
+        :return: label that appear most frequently, the smallest one on other ties
         :rtype: int
         """
-        return max(label_list, key=label_list.count)
+        majority = np.flatnonzero(counts == counts.max())
+        if tie_label in majority:
+            return int(tie_label)
+        return int(majority[0])
 
     @staticmethod
     def split_dataset(data_list, label_list, attr_idx, attr_val, is_continuous=False):
@@ -239,7 +1238,7 @@ class DecisionTree:
         return data_list1, label_list1, data_list2, label_list2
 
     def cal_split_gini(self, data_list1, label_list1, data_list2, label_list2):
-        """ Calculate GINI index of a split
+        """ Calculate the impurity of a split by the criterion of the tree, the GINI index by default
 
         :param data_list1: data subset1
         :param label_list1: label subset1
@@ -249,34 +1248,25 @@ class DecisionTree:
         :type label_list1: List[int]
         :type data_list2: List[List[int]]
         :type label_list2: List[int]
-        :return: GINI index of the split
+        :return: impurity of the split
         :rtype: float
         """
-        s1 = len(data_list1)
-        s2 = len(data_list2)
-        s = s1 + s2
-        gini1 = self.cal_gini(data_list1, label_list1)
-        gini2 = self.cal_gini(data_list2, label_list2)
-        return round(s1 / s * gini1 + s2 / s * gini2, 6)
+        counts1 = [label_list1.count(label) for label in range(self.n_classes)]
+        counts2 = [label_list2.count(label) for label in range(self.n_classes)]
+        return self.criterion.split_impurity(counts1, counts2)
 
-    @staticmethod
-    def cal_gini(data_list, label_list):
-        """ Calculate the GINI index of a subset
+    def cal_gini(self, data_list, label_list):
+        """ Calculate the impurity of a subset by the criterion of the tree, the GINI index by default
 
         :param data_list: subset of training data
         :param label_list: subset of training label
         :type data_list: List[List[int]]
         :type label_list: List[int]
-        :return: GINI index of the subset
+        :return: impurity of the subset
         :rtype: float
         """
-        n = len(data_list)
-        if n == 0:
-            return 1
-        ny = len(list(filter(lambda x: x == 1, label_list)))
-        py = ny / n
-        pn = 1 - py
-        return round(1 - (py * py + pn * pn), 6)
+        counts = [label_list.count(label) for label in range(max(self.n_classes, max(label_list, default=-1) + 1))]
+        return self.criterion.node_impurity(counts)
 
     def classify(self, data):
         """ Classify a list of data
@@ -286,7 +1276,14 @@ class DecisionTree:
         :return: predicted label 0 or 1
         :rtype: int
         """
-        return self.traverse(self.root, data)
+        if self.cache is None:
+            return self.compiled.predict(data) if self.compiled is not None else self.traverse(self.root, data)
+        key = tuple(data)
+        label = self.cache.get(key)
+        if label is None:
+            label = self.compiled.predict(data) if self.compiled is not None else self.traverse(self.root, data)
+            self.cache.put(key, label)
+        return label
 
     def traverse(self, root, data):
         """ Traverse DecisionTree from certain node
@@ -303,18 +1300,175 @@ class DecisionTree:
         if root.is_leaf:
             return root.result
         if root.true_brunch:
-            attr_idx = root.true_brunch.attr_idx
-            attr_val = root.true_brunch.attr_val
-            if data[attr_idx] == attr_val:
+            attr_idx = root.attr_idx
+            attr_val = root.attr_val
+            # same test as the split in create_tree
+            if attr_idx in self.continuous_features:
+                is_true = data[attr_idx] <= attr_val
+            else:
+                is_true = data[attr_idx] == attr_val
+            if is_true:
                 return self.traverse(root.true_brunch, data)
         if root.false_brunch:
             return self.traverse(root.false_brunch, data)
         return -1
 
+    def predict_batch(self, matrix):
+        """ Classify many rows at once
+
+        With a cache, identical rows are merged and only the distinct rows
+        not cached are routed, see PredictionCache.predict_batch.
+
+        :param matrix: encode attribute matrix, one row per data
+        :type matrix: numpy.ndarray | List[List[int]]
+        :return: predicted label of each row, -1 error or root is None
+        :rtype: numpy.ndarray
+        """
+        if self.cache is None:
+            return self.route_batch(matrix)
+        return self.cache.predict_batch(matrix, self.route_batch, [len(d) for d in self.feature_dict_list[:-1]])
+
+    def route_batch(self, matrix):
+        """ Classify many rows at once without the cache
+
+        The row indexes are routed through the tree node by node with array
+        masks, each leaf labels all the rows that reach it. A loaded tree is
+        routed by its node arrays instead.
+
+        :param matrix: encode attribute matrix, one row per data
+        :type matrix: numpy.ndarray | List[List[int]]
+        :return: predicted label of each row, -1 error or root is None
+        :rtype: numpy.ndarray
+        """
+        if self.compiled is not None:
+            return self.compiled.predict_batch(matrix)
+        matrix = np.asarray(matrix)
+        result = np.full(len(matrix), -1, dtype=np.int64)
+        if self.root is None or len(matrix) == 0:
+            return result
+        stack = [(self.root, np.arange(len(matrix)))]
+        while stack:
+            node, rows = stack.pop()
+            if node.is_leaf:
+                result[rows] = node.result
+                continue
+            if node.true_brunch:
+                attr_idx = node.attr_idx
+                attr_val = node.attr_val
+                if attr_idx in self.continuous_features:
+                    mask = matrix[rows, attr_idx] <= attr_val
+                else:
+                    mask = matrix[rows, attr_idx] == attr_val
+                if np.any(mask):
+                    stack.append((node.true_brunch, rows[mask]))
+                rows = rows[~mask]
+            if node.false_brunch and len(rows) > 0:
+                stack.append((node.false_brunch, rows))
+        return result
+
+    def compile(self):
+        """ Compile the trained tree into flat node arrays for fast inference
+
+        :return: compiled tree with non-recursive single row & batch predictors
+        :rtype: CompiledTree
+        """
+        if self.compiled is not None:
+            return self.compiled
+        return CompiledTree.from_tree(self.root, self.continuous_features)
+
+    def save(self, file_path):
+        """ Save the trained tree to a binary model file
+
+        The file holds the compiled node arrays with the majority label of
+        every node, the feature dictionaries, the continuous feature indexes
+        and the options used by update & prune, see model_file. The
+        criterion is stored by name, a custom Criterion must be in
+        impurity.CRITERIA to be loaded.
+
+        :param file_path: path of the model file
+        :type file_path: str
+        """
+        write_model(file_path, self.compile(), {
+            'feature_dict_list': self.feature_dict_list,
+            'continuous_features': self.continuous_features,
+            'threshold': self.threshold,
+            'criterion': self.criterion.name,
+            'feature_scope': self.feature_scope,
+            'max_features': self.max_features,
+            'min_samples_leaf': self.min_samples_leaf,
+        })
+
+    def export_source(self, file_path, vectorized=False):
+        """ Export the trained tree as a standalone Python module of nested if comparisons
+
+        The module needs neither this package nor, unless vectorized, numpy,
+        see codegen.
+
+        :param file_path: path of the .py file
+        :param vectorized: generate predict_batch with numpy.select
+        :type file_path: str
+        :type vectorized: bool
+        """
+        write_source(file_path, self.root, self.continuous_features, self.feature_dict_list, vectorized)
+
+    def clear_cache(self):
+        """ Drop the cached predictions and loaded node arrays, called whenever the tree is grown, updated or pruned """
+        self.compiled = None
+        if self.cache is not None:
+            self.cache.clear()
+
+    @classmethod
+    def load(cls, file_path, use_mmap=True, cache_size=None):
+        """ Load a tree saved by save
+
+        The tree classifies with the node arrays of the file, memory-mapped
+        with use_mmap, so processes loading the same file share them. The
+        tree of TreeNode is only built when root is used, e.g. by print_tree,
+        update or prune, and the node arrays are dropped once it changes.
+
+        :param file_path: path of the model file
+        :param use_mmap: memory-map the node arrays of the file, see model_file.read_model
+        :param cache_size: size of the prediction cache, None for no cache
+        :type file_path: str
+        :type use_mmap: bool
+        :type cache_size: int
+        :return: decision tree ready for classification
+        :rtype: DecisionTree
+        """
+        compiled, metadata = read_model(file_path, use_mmap)
+        feature_dict_list = [{int(k): v for k, v in feature_dict.items()}
+                             for feature_dict in metadata['feature_dict_list']]
+        # files of the first version have no options but threshold
+        tree = cls(None, None, feature_dict_list, metadata['continuous_features'], threshold=metadata['threshold'],
+                   max_features=metadata.get('max_features'), min_samples_leaf=metadata.get('min_samples_leaf'),
+                   criterion=metadata.get('criterion', 'gini'), feature_scope=metadata.get('feature_scope', 'tree'),
+                   cache_size=cache_size)
+        tree.compiled = compiled
+        return tree
+
     def print_tree(self):
-        output = open("decision_tree.txt", 'w+')
-        print(self._tree(self.root), file=output)
-        output.close()
+        # the text is built before the file is opened, so an error does not leave it truncated
+        text = self._tree(self.root)
+        with open("decision_tree.txt", 'w+') as output:
+            print(text, file=output)
+
+    def split_text(self, attr_idx, attr_val):
+        """ Describe the test of a split with the attribute values of the feature dictionary
+
+        :param attr_idx: split attribute index
+        :param attr_val: split attribute value
+        :type attr_idx: int
+        :type attr_val: int
+        :return: e.g. '<= 30' for a continuous feature, 'whether Private' for a category feature
+        :rtype: str
+        """
+        value = str(self.feature_dict_list[attr_idx].get(int(attr_val), attr_val))
+        if attr_idx not in self.continuous_features:
+            return "whether " + value
+        # the values of a continuous feature are the upper bounds of its groups, the last group has none
+        if value.endswith('+'):
+            return "> " + value[:-1]
+        return "<= " + value
 
     def _tree(self, point, prefix=[]):
         """ Create text description for decision tree
@@ -332,27 +1486,6 @@ class DecisionTree:
         last = '|_ '
         feature = ['age', 'workclass', 'fnlwgt', 'education', 'education-num', 'marital-status', 'occupation',
                    'relationship', 'race', 'sex', 'capital-gain', 'capital-loss', 'hours-per-week']
-        feature_map = [
-            ['< 30', '< 40', '< 50', '< 60', '> 60'],
-            ["whether Without-pay", "whether State-gov", "whether Self-emp-not-inc", "whether Local-gov", "whether Federal-gov", "whether Private",
-             "whether Self-emp-inc"],
-            ["< 600000", "> 600000"],
-            ["Prof-school", "Some-college", "5th-6th", "HS-grad", "11th", "9th", "Doctorate", "Assoc-acdm", "Preschool",
-             "Masters", "7th-8th", "Assoc-voc", "10th", "12th", "1st-4th", "Bachelors"],
-            ["< 11", "< 15", "> 15"],
-            ["whether Married-spouse-absent", "whether Never-married", "whether Widowed", "whether Divorced", "whether Married-AF-spouse",
-             "whether Married-civ-spouse", "Separated"],
-            ["whether Sales", "whether Tech-support", "whether Craft-repair", "whether Armed-Forces", "whether Protective-serv",
-             "whether Handlers-cleaners", "whether Other-service", "whether Machine-op-inspct", "whether Farming-fishing",
-             "whether Priv-house-serv", "whether Adm-clerical", "whetherTransport-moving", "whether Prof-specialty", "whether Exec-managerial"],
-            ["whether Not-in-family", "whether Unmarried", "whether Husband", "whether Own-child", "whether Wife", "whether Other-relative"],
-            ["whether White", "whether Other", "whether Black", "whether Amer-Indian-Eskimo", "whether Asian-Pac-Islander"],
-            ["whether Female", "whether Male"],
-            ["< 5000", "< 10000", "< 15000", "< 20000", "> 20000"],
-            ["< 1000", "< 1500", "< 2000", "> 2000"],
-            ["< 20", "< 40", "> 40"]
-        ]
-
         if len(prefix) == 0:
             self.tree_plot = ''
 
@@ -361,8 +1494,7 @@ class DecisionTree:
         if not point.is_leaf:
             if point.true_brunch:
                 self.tree_plot += "The splitting feature is " + str(
-                    feature[point.true_brunch.attr_idx]) + " " + str(
-                    feature_map[point.true_brunch.attr_idx][point.true_brunch.attr_val]) + "\n"
+                    feature[point.attr_idx]) + " " + self.split_text(point.attr_idx, point.attr_val) + "\n"
         else:
             if point.result == 0:
                 self.tree_plot += "Label is <= 50K\n"
@@ -379,3 +1511,34 @@ class DecisionTree:
             if point.false_brunch:
                 self._tree(point.false_brunch, prefix + [last])
         return self.tree_plot
+
+
+# state of a split search worker process, set by _init_split_worker
+_split_worker = {}
+
+
+def _init_split_worker(specs, feature_dict_list, continuous_features, options):
+    shared_list = [SharedArray.attach(spec) for spec in specs]
+    matrix, labels, index = [shared.array for shared in shared_list[:3]]
+    _split_worker['shared_list'] = shared_list
+    _split_worker['columns'] = [matrix[:, i] for i in range(matrix.shape[1])]
+    _split_worker['labels'] = labels
+    _split_worker['index'] = index
+    _split_worker['weights'] = shared_list[3].array if len(shared_list) > 3 else None
+    _split_worker['tree'] = DecisionTree(None, None, feature_dict_list, continuous_features, **options)
+
+
+def _score_features_worker(start, end, feature_idx_list):
+    rows = _split_worker['index'][start:end]
+    return _split_worker['tree'].score_features(_split_worker['columns'], _split_worker['labels'], rows,
+                                                feature_idx_list, _split_worker['weights'])
+
+
+def _grow_subtree_worker(start, end, depth, feature_idx_list, seed, instrument):
+    tree = _split_worker['tree']
+    tree.rng = np.random.default_rng(seed)
+    tree.instrument = TrainingStats() if instrument else None
+    root = TreeNode()
+    tree.grow_nodes(_split_worker['columns'], _split_worker['labels'], _split_worker['index'], root,
+                    feature_idx_list, weights=_split_worker['weights'], start=start, end=end, depth=depth)
+    return root, None if tree.instrument is None else tree.instrument.nodes
@@ -0,0 +1,158 @@
+import math
+
+import numpy as np
+
+# bound of the difference between the impurity of a split and its unrounded estimate
+ROUNDING_ERROR = 4e-6
+
+
+class Criterion:
+    """ The definition of Criterion, the impurity measure of the split search
+
+    A subclass defines impurity on the class counts of a subset, as scalars
+    for the exact score of a split and as arrays for the estimate of many
+    splits at once. Counts are numbers of rows or sums of sample weights,
+    index k holds the count of label k. Impurities are rounded to 6 places
+    like the GINI index of the first versions.
+    """
+    name = None
+
+    def impurity(self, counts, n):
+        """ Returns the unrounded impurity of a non-empty subset
+
+        :param counts: class counts of the subset
+        :param n: size of the subset, the sum of counts
+        :type counts: List[float]
+        :type n: float
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def impurity_array(self, counts, n):
+        """ Returns the unrounded impurities of many non-empty subsets, the same arithmetic as impurity
+
+        :param counts: class counts of each subset
+        :param n: size of each subset
+        :type counts: numpy.ndarray
+        :type n: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        raise NotImplementedError
+
+    def max_impurity(self, n_classes):
+        """ Returns the impurity of a subset with all the classes equally frequent
+
+        :param n_classes: number of classes
+        :type n_classes: int
+        :rtype: float
+        """
+        raise NotImplementedError
+
+    def node_impurity(self, counts):
+        """ Calculate the impurity of a subset from its class counts
+
+        :param counts: class counts of the subset
+        :type counts: List[float]
+        :return: impurity of the subset, 1 for an empty subset
+        :rtype: float
+        """
+        n = sum(counts)
+        if n == 0:
+            return 1
+        return round(self.impurity(counts, n), 6)
+
+    def split_impurity(self, counts1, counts2):
+        """ Calculate the impurity of a split from the class counts of both subsets
+
+        :param counts1: class counts of subset1
+        :param counts2: class counts of subset2
+        :type counts1: List[float]
+        :type counts2: List[float]
+        :return: impurity of the subsets weighted by their size
+        :rtype: float
+        """
+        s1 = sum(counts1)
+        s2 = sum(counts2)
+        s = s1 + s2
+        impurity1 = self.node_impurity(counts1)
+        impurity2 = self.node_impurity(counts2)
+        return round(s1 / s * impurity1 + s2 / s * impurity2, 6)
+
+    def estimate_split(self, counts1, counts2):
+        """ Estimate the impurity of many splits at once, within ROUNDING_ERROR of split_impurity
+
+        :param counts1: class counts of subset1 of each split
+        :param counts2: class counts of subset2 of each split
+        :type counts1: numpy.ndarray
+        :type counts2: numpy.ndarray
+        :rtype: numpy.ndarray
+        """
+        s1 = counts1.sum(axis=1)
+        s2 = counts2.sum(axis=1)
+        s = s1 + s2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            impurity1 = np.where(s1 > 0, self.impurity_array(counts1, s1), 1)
+            impurity2 = np.where(s2 > 0, self.impurity_array(counts2, s2), 1)
+        return s1 / s * impurity1 + s2 / s * impurity2
+
+
+class Gini(Criterion):
+    """ GINI index, 1 - sum of the squared class frequencies """
+    name = 'gini'
+
+    def impurity(self, counts, n):
+        # label 0 takes the rest of the frequency, so two labels give 1 - (py * py + pn * pn) with pn = 1 - py
+        rest = 1
+        square_sum = 0
+        for count in counts[1:]:
+            p = count / n
+            rest -= p
+            square_sum += p * p
+        return 1 - (square_sum + rest * rest)
+
+    def impurity_array(self, counts, n):
+        p = counts[:, 1:] / n[:, None]
+        rest = 1 - p.sum(axis=1)
+        return 1 - ((p * p).sum(axis=1) + rest * rest)
+
+    def max_impurity(self, n_classes):
+        return 1 - 1 / n_classes
+
+
+class Entropy(Criterion):
+    """ Information entropy in bits, - sum of p * log2(p) over the class frequencies """
+    name = 'entropy'
+
+    def impurity(self, counts, n):
+        entropy = 0
+        for count in counts:
+            if count > 0:
+                p = count / n
+                entropy -= p * math.log2(p)
+        return entropy
+
+    def impurity_array(self, counts, n):
+        p = counts / n[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return -np.where(p > 0, p * np.log2(p), 0).sum(axis=1)
+
+    def max_impurity(self, n_classes):
+        return math.log2(n_classes)
+
+
+CRITERIA = {criterion.name: criterion for criterion in (Gini, Entropy)}
+
+
+def get_criterion(criterion):
+    """ Returns the criterion of a name, a Criterion is returned as is
+
+    :param criterion: 'gini', 'entropy' or a Criterion
+    :type criterion: str | Criterion
+    :rtype: Criterion
+    :raise ValueError
+    """
+    if isinstance(criterion, Criterion):
+        return criterion
+    if criterion not in CRITERIA:
+        raise ValueError("criterion %r is NOT supported (expected one of %s)" % (criterion, ', '.join(CRITERIA)))
+    return CRITERIA[criterion]()
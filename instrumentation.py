@@ -0,0 +1,72 @@
+class TrainingStats:
+    """ The definition of TrainingStats, per node statistics of DecisionTree training
+
+    Pass an instance as DecisionTree(instrument=...) to collect one record per
+    node grown by create_tree. A record is a dict with
+
+    * depth: depth of the node, the root is 0
+    * n_rows: number of training rows of the node
+    * is_leaf: if leave node
+    * leaf_reason: why the node is a leaf (same_class, same_attribute, threshold,
+      no_feature, no_gain, empty, max_depth, min_impurity_decrease,
+      max_leaf_nodes) or None
+    * attr_idx, attr_val: split of the node, -1 for leave node
+    * n_features: number of candidate features scored
+    * candidate_splits: number of candidate splits estimated at once
+    * exact_splits: number of those splits close enough to the best to be
+      scored exactly by the criterion, two subset impurities each
+    * find_best_split_seconds: time of the split search
+    * split_dataset_seconds: time of partitioning the rows into S1 & S2
+
+    :param callback: called with every record as soon as its node is done
+    :type callback: Callable[[Dict], None]
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.nodes = []
+
+    def on_node(self, record):
+        """ Collect the record of a node
+
+        :param record: node statistics
+        :type record: Dict
+        """
+        self.nodes.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def clear(self):
+        self.nodes = []
+
+    def report(self):
+        """ Summarize the records of all nodes
+
+        :return: totals of the training, totals per depth and number of splits per feature
+        :rtype: Dict
+        """
+        total_keys = ('candidate_splits', 'exact_splits', 'find_best_split_seconds', 'split_dataset_seconds')
+        report = {
+            'nodes': len(self.nodes),
+            'leaves': sum(1 for record in self.nodes if record['is_leaf']),
+            'max_depth': max((record['depth'] for record in self.nodes), default=0),
+        }
+        for key in total_keys:
+            report[key] = sum(record[key] for record in self.nodes)
+
+        by_depth = {}
+        leaf_reasons = {}
+        splits_by_feature = {}
+        for record in self.nodes:
+            depth = by_depth.setdefault(record['depth'], dict({key: 0 for key in total_keys}, nodes=0, rows=0))
+            depth['nodes'] += 1
+            depth['rows'] += record['n_rows']
+            for key in total_keys:
+                depth[key] += record[key]
+            if record['is_leaf']:
+                leaf_reasons[record['leaf_reason']] = leaf_reasons.get(record['leaf_reason'], 0) + 1
+            else:
+                splits_by_feature[record['attr_idx']] = splits_by_feature.get(record['attr_idx'], 0) + 1
+        report['by_depth'] = [dict(by_depth[depth], depth=depth) for depth in sorted(by_depth)]
+        report['leaf_reasons'] = leaf_reasons
+        report['splits_by_feature'] = splits_by_feature
+        return report
@@ -0,0 +1,163 @@
+""" Load generator for serve.py
+
+Opens --concurrency keep-alive connections to the server and sends
+--requests prediction requests of --rows-per-request rows of adult.test,
+then prints the throughput, the client side latency percentiles and the
+/stats of the server, e.g.
+
+    python serve.py --model model.dtm --port 8000 &
+    python load_test.py --port 8000 --concurrency 64 --requests 20000
+    python load_test.py --port 8000 --reload-every 2000 --model model.dtm
+
+With --model the answers are checked against the batch predictor of the
+model file. --reload-every reloads the model on the server every N
+requests, to check that no request is dropped meanwhile.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+import numpy as np
+
+from data_process import load_dataset
+from model_file import read_model
+
+
+class Connection:
+    """ The definition of Connection, one keep-alive HTTP/1.1 connection to the server
+
+    :param host: server host
+    :param port: server port
+    :type host: str
+    :type port: int
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        """ Send a request and read its response
+
+        :param method: HTTP method
+        :param path: request path
+        :param payload: JSON request body
+        :type method: str
+        :type path: str
+        :type payload: Dict
+        :return: HTTP status & JSON response
+        :rtype: int, Dict
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        self.writer.write(('%s %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                           % (method, path, self.host, len(body))).encode('latin-1') + body)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            with contextlib.suppress(ConnectionError):
+                await self.writer.wait_closed()
+
+
+async def run(args, matrix):
+    """ Send all requests and collect the results
+
+    :param args: command line arguments
+    :param matrix: encode attribute matrix of the rows to send
+    :type args: argparse.Namespace
+    :type matrix: numpy.ndarray
+    :return: latencies (s), responses (request index, status, response), reload versions, elapsed time, server stats
+    :rtype: List[float], List[Tuple[int, int, Dict]], List[int], float, Dict
+    """
+    latencies = []
+    responses = []
+    reloads = []
+    next_request = 0
+
+    async def client():
+        nonlocal next_request
+        connection = Connection(args.host, args.port)
+        try:
+            while next_request < args.requests:
+                i = next_request
+                next_request += 1
+                if args.reload_every and i > 0 and i % args.reload_every == 0:
+                    status, response = await connection.request('POST', '/reload', {})
+                    reloads.append(response.get('model_version', status))
+                start = i * args.rows_per_request % (len(matrix) - args.rows_per_request)
+                rows = matrix[start:start + args.rows_per_request].tolist()
+                begin = time.perf_counter()
+                status, response = await connection.request('POST', '/predict', {'rows': rows})
+                latencies.append(time.perf_counter() - begin)
+                responses.append((i, status, response))
+        finally:
+            await connection.close()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start_time
+    connection = Connection(args.host, args.port)
+    _, server_stats = await connection.request('GET', '/stats')
+    await connection.close()
+    return latencies, responses, reloads, elapsed, server_stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--data', default='adult/adult.test', help='adult data file of the rows to send')
+    parser.add_argument('--dict-path', default='my_dict.json', help='feature dictionary')
+    parser.add_argument('--concurrency', type=int, default=32, help='number of connections')
+    parser.add_argument('--requests', type=int, default=10000, help='number of prediction requests')
+    parser.add_argument('--rows-per-request', type=int, default=1)
+    parser.add_argument('--reload-every', type=int, default=0, help='reload the model every N requests')
+    parser.add_argument('--model', help='model file to check the answers against')
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        matrix = load_dataset(args.data, args.dict_path)[0]
+    # wrap around without a short last request
+    matrix = np.concatenate([matrix, matrix[:args.rows_per_request]])
+    latencies, responses, reloads, elapsed, server_stats = asyncio.run(run(args, matrix))
+
+    errors = [(status, response) for _, status, response in responses if status != 200]
+    n_rows = sum(len(response['labels']) for _, status, response in responses if status == 200)
+    p50, p90, p99, p_max = np.percentile(np.array(latencies) * 1000, [50, 90, 99, 100]).tolist()
+    print('%d requests, %d rows in %.3f s: %.0f requests/s, %.0f rows/s' % (
+        len(responses), n_rows, elapsed, len(responses) / elapsed, n_rows / elapsed))
+    print('latency ms: p50 %.3f p90 %.3f p99 %.3f max %.3f' % (p50, p90, p99, p_max))
+    print('errors: %d%s' % (len(errors), (' first: %r' % (errors[0],)) if errors else ''))
+    if reloads:
+        print('reloads: %d, model version %s' % (len(reloads), reloads[-1]))
+    if args.model:
+        compiled = read_model(args.model)[0]
+        expected = compiled.predict_batch(matrix)
+        wrong = 0
+        for i, status, response in responses:
+            if status == 200:
+                start = i * args.rows_per_request % (len(matrix) - args.rows_per_request)
+                wrong += int(np.count_nonzero(expected[start:start + len(response['labels'])] != response['labels']))
+        print('wrong labels: %d' % wrong)
+    print('server: ' + json.dumps(server_stats))
+
+
+if __name__ == '__main__':
+    main()
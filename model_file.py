@@ -0,0 +1,82 @@
+import json
+import mmap
+
+import numpy as np
+
+from compiled_tree import CompiledTree
+
+# file layout: MAGIC, version (uint32), header length (uint32), JSON header, node arrays
+# every node array starts at an offset aligned to ARRAY_ALIGN bytes from the start of the file
+MAGIC = b'DTMODEL\x00'
+MODEL_VERSION = 1
+ARRAY_ALIGN = 64
+ARRAY_NAMES = ('feature', 'value', 'kind', 'true_child', 'false_child', 'leaf_value')
+
+
+def write_model(file_path, compiled, metadata):
+    """ Write a compiled tree and its metadata to a binary model file
+
+    :param file_path: path of the model file
+    :param compiled: compiled tree
+    :param metadata: JSON serializable information stored in the header, e.g. feature dictionaries
+    :type file_path: str
+    :type compiled: CompiledTree
+    :type metadata: Dict
+    """
+    arrays = [np.ascontiguousarray(getattr(compiled, name)) for name in ARRAY_NAMES]
+    # offsets are relative to the end of the header, which is only known after the header is encoded
+    layout = []
+    offset = 0
+    for name, array in zip(ARRAY_NAMES, arrays):
+        layout.append({'name': name, 'dtype': array.dtype.newbyteorder('<').str, 'count': len(array),
+                       'offset': offset})
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({'arrays': layout, 'metadata': metadata}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    with open(file_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.array([MODEL_VERSION, len(header)], dtype='<u4').tobytes())
+        f.write(header)
+        for entry, array in zip(layout, arrays):
+            f.write(b'\x00' * (data_start + entry['offset'] - f.tell()))
+            f.write(array.astype(entry['dtype'], copy=False).tobytes())
+
+
+def read_model(file_path, use_mmap=True):
+    """ Read a binary model file
+
+    With use_mmap the node arrays are read-only views of the memory-mapped
+    file, so processes loading the same file share one copy of the model.
+
+    :param file_path: path of the model file
+    :param use_mmap: memory-map the file instead of reading it
+    :type file_path: str
+    :type use_mmap: bool
+    :return: compiled tree & metadata of the model
+    :rtype: CompiledTree, Dict
+    :raise ValueError
+    """
+    with open(file_path, 'rb') as f:
+        if use_mmap:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buffer = f.read()
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("%s is NOT a decision tree model file" % file_path)
+    version, header_len = np.frombuffer(buffer, dtype='<u4', count=2, offset=len(MAGIC)).tolist()
+    if version != MODEL_VERSION:
+        raise ValueError("model file version %d is NOT supported (expected %d)" % (version, MODEL_VERSION))
+    header_start = len(MAGIC) + 8
+    header = json.loads(bytes(buffer[header_start:header_start + header_len]).decode('utf-8'))
+    data_start = _align(header_start + header_len)
+
+    arrays = {}
+    for entry in header['arrays']:
+        arrays[entry['name']] = np.frombuffer(buffer, dtype=entry['dtype'], count=entry['count'],
+                                              offset=data_start + entry['offset'])
+    return CompiledTree(*[arrays[name] for name in ARRAY_NAMES]), header['metadata']
+
+
+def _align(offset):
+    return -(-offset // ARRAY_ALIGN) * ARRAY_ALIGN
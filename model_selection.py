@@ -0,0 +1,292 @@
+""" K-fold cross-validation and grid / random search of DecisionTree options
+
+The data is encoded once (load_dataset caches it), moved to shared memory
+and read by all worker processes, every (configuration, fold) pair is one
+task of the process pool. Each configuration is reported with its mean
+accuracy over the folds, its train time and its predict time per row, e.g.
+
+    python model_selection.py --grid threshold=2,5,20,100 max_depth=None,3,6 --folds 5 --n-jobs 4
+    python model_selection.py --random 30 --grid min_samples_leaf=1,10,50,200 max_leaf_nodes=None,8,16,64
+
+The configurations on the accuracy / predict time frontier, i.e. those no
+other configuration beats on both, are marked with *.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from data_process import load_dataset
+from decision_tree import DecisionTree
+from shared_array import SharedArray
+
+PREDICT_REPEAT = 5
+
+
+def assign_folds(n_rows, n_folds=5, random_state=None):
+    """ Assign each row to one of n_folds folds of (almost) equal size at random
+
+    :param n_rows: number of rows
+    :param n_folds: number of folds
+    :param random_state: seed of the shuffle, the same seed gives the same folds
+    :type n_rows: int
+    :type n_folds: int
+    :type random_state: int
+    :return: fold of each row
+    :rtype: numpy.ndarray
+    """
+    if n_folds < 2 or n_folds > n_rows:
+        raise ValueError("n_folds must be between 2 and the number of rows")
+    folds = np.arange(n_rows) % n_folds
+    np.random.default_rng(random_state).shuffle(folds)
+    return folds.astype(np.int16)
+
+
+def grid_configs(param_grid):
+    """ Returns every combination of the option values
+
+    :param param_grid: DecisionTree option -> list of values
+    :type param_grid: Dict[str, List]
+    :return: one dict of options per combination
+    :rtype: List[Dict]
+    """
+    names = list(param_grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(param_grid[name] for name in names))]
+
+
+def random_configs(param_distributions, n_iter, random_state=None):
+    """ Returns n_iter combinations of option values drawn at random, distinct when all options are lists
+
+    :param param_distributions: DecisionTree option -> list of values to draw from,
+        or a function drawing a value from a numpy.random.Generator
+    :param n_iter: number of combinations, at most the size of the grid for lists only
+    :param random_state: seed of the draws
+    :type param_distributions: Dict[str, List | Callable]
+    :type n_iter: int
+    :type random_state: int
+    :rtype: List[Dict]
+    """
+    rng = np.random.default_rng(random_state)
+    if all(not callable(values) for values in param_distributions.values()):
+        configs = grid_configs(param_distributions)
+        if n_iter >= len(configs):
+            return configs
+        return [configs[i] for i in sorted(rng.choice(len(configs), size=n_iter, replace=False))]
+    configs = []
+    for _ in range(n_iter):
+        configs.append({name: values(rng) if callable(values) else values[rng.integers(len(values))]
+                        for name, values in param_distributions.items()})
+    return configs
+
+
+def cross_validate(matrix, labels, feature_dict_list, continuous_features, configs, n_folds=5, n_jobs=1,
+                   random_state=None, feature_idx_list=None):
+    """ Score DecisionTree configurations by k-fold cross-validation
+
+    Every configuration is trained on all folds but one and tested on the
+    left-out fold, once per fold. With n_jobs > 1 the matrix, the labels
+    and the folds are shared with the worker processes, which run the
+    (configuration, fold) pairs in parallel. The results do not depend on
+    n_jobs.
+
+    :param matrix: encode attribute matrix
+    :param labels: encode label vector
+    :param feature_dict_list: dict list  key:encode val:feature (attribute & label)
+    :param continuous_features: index of continuous feature
+    :param configs: DecisionTree options of each configuration, without n_jobs
+    :param n_folds: number of folds
+    :param n_jobs: number of worker processes
+    :param random_state: seed of the folds
+    :param feature_idx_list: list of feature indexes to split on, None for all
+    :type matrix: numpy.ndarray
+    :type labels: numpy.ndarray
+    :type feature_dict_list: List[Dict[int,str]]
+    :type continuous_features: List[int]
+    :type configs: List[Dict]
+    :type n_folds: int
+    :type n_jobs: int
+    :type random_state: int
+    :type feature_idx_list: List[int]
+    :return: one result per configuration, in the order of configs: options, accuracy of each fold, mean &
+             standard deviation of the accuracy, mean nodes, mean train seconds & mean predict seconds per row
+    :rtype: List[Dict]
+    """
+    matrix = np.asarray(matrix)
+    labels = np.asarray(labels)
+    folds = assign_folds(len(labels), n_folds, random_state)
+    params = {
+        'feature_dict_list': feature_dict_list,
+        'continuous_features': continuous_features,
+        'feature_idx_list': list(range(matrix.shape[1])) if feature_idx_list is None else feature_idx_list,
+    }
+    tasks = [(config, fold) for config in configs for fold in range(n_folds)]
+    if n_jobs > 1:
+        shared_list = [SharedArray.copy_of(matrix), SharedArray.copy_of(labels), SharedArray.copy_of(folds)]
+        try:
+            specs = [shared.spec() for shared in shared_list]
+            with ProcessPoolExecutor(n_jobs, initializer=_init_cv_worker, initargs=(specs, params)) as pool:
+                scores = list(pool.map(_score_fold_worker, tasks))
+        finally:
+            for shared in shared_list:
+                shared.close()
+    else:
+        scores = [score_fold(matrix, labels, folds, config, fold, params) for config, fold in tasks]
+
+    results = []
+    for i, config in enumerate(configs):
+        fold_scores = scores[i * n_folds:(i + 1) * n_folds]
+        accuracy = [score['accuracy'] for score in fold_scores]
+        results.append({
+            'config': config,
+            'fold_accuracy': accuracy,
+            'accuracy': float(np.mean(accuracy)),
+            'accuracy_std': float(np.std(accuracy)),
+            'nodes': float(np.mean([score['nodes'] for score in fold_scores])),
+            'train_seconds': float(np.mean([score['train_seconds'] for score in fold_scores])),
+            'predict_seconds_per_row': float(np.mean([score['predict_seconds_per_row'] for score in fold_scores])),
+        })
+    return results
+
+
+def score_fold(matrix, labels, folds, config, fold, params):
+    """ Train one configuration on all folds but one and test it on the left-out fold
+
+    The predict time is the best of PREDICT_REPEAT runs of the compiled
+    tree, as used for serving, so that one slow run does not move a
+    configuration off the frontier.
+
+    :param matrix: encode attribute matrix
+    :param labels: encode label vector
+    :param folds: fold of each row
+    :param config: DecisionTree options
+    :param fold: left-out fold
+    :param params: data options from cross_validate
+    :type matrix: numpy.ndarray
+    :type labels: numpy.ndarray
+    :type folds: numpy.ndarray
+    :type config: Dict
+    :type fold: int
+    :type params: Dict
+    :return: accuracy, nodes, train seconds & predict seconds per row
+    :rtype: Dict
+    """
+    is_test = folds == fold
+    train_matrix = matrix[~is_test]
+    train_labels = labels[~is_test]
+    test_matrix = matrix[is_test]
+    start = time.perf_counter()
+    tree = DecisionTree(train_matrix, train_labels, params['feature_dict_list'], params['continuous_features'],
+                        **config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tree.create_tree(train_matrix, train_labels, feature_idx_list=list(params['feature_idx_list']))
+    train_seconds = time.perf_counter() - start
+    compiled = tree.compile()
+    predict_seconds = float('inf')
+    for _ in range(PREDICT_REPEAT):
+        start = time.perf_counter()
+        predicted = compiled.predict_batch(test_matrix)
+        predict_seconds = min(predict_seconds, time.perf_counter() - start)
+    return {
+        'accuracy': float(np.mean(predicted == labels[is_test])),
+        'nodes': len(compiled),
+        'train_seconds': train_seconds,
+        'predict_seconds_per_row': predict_seconds / max(len(test_matrix), 1),
+    }
+
+
+def pareto_front(results):
+    """ Returns the results no other result beats on both accuracy and predict time
+
+    :param results: results of cross_validate
+    :type results: List[Dict]
+    :return: indexes of the frontier results, from the fastest to the most accurate
+    :rtype: List[int]
+    """
+    order = sorted(range(len(results)), key=lambda i: (results[i]['predict_seconds_per_row'],
+                                                        -results[i]['accuracy']))
+    front = []
+    best_accuracy = -1
+    for i in order:
+        if results[i]['accuracy'] > best_accuracy:
+            front.append(i)
+            best_accuracy = results[i]['accuracy']
+    return front
+
+
+def parse_value(text):
+    """ Parse an option value of the command line: None, int, float or str """
+    if text == 'None':
+        return None
+    for parse in (int, float):
+        try:
+            return parse(text)
+        except ValueError:
+            pass
+    return text
+
+
+# state of a cross-validation worker process, set by _init_cv_worker
+_cv_worker = {}
+
+
+def _init_cv_worker(specs, params):
+    shared_list = [SharedArray.attach(spec) for spec in specs]
+    _cv_worker['shared_list'] = shared_list
+    _cv_worker['matrix'] = shared_list[0].array
+    _cv_worker['labels'] = shared_list[1].array
+    _cv_worker['folds'] = shared_list[2].array
+    _cv_worker['params'] = params
+
+
+def _score_fold_worker(task):
+    config, fold = task
+    return score_fold(_cv_worker['matrix'], _cv_worker['labels'], _cv_worker['folds'], config, fold,
+                      _cv_worker['params'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', default='adult/adult.data', help='adult data file')
+    parser.add_argument('--dict-path', default='my_dict.json', help='feature dictionary')
+    parser.add_argument('--grid', nargs='+', default=['threshold=2,5,20,100'],
+                        help='option=value1,value2,... of DecisionTree')
+    parser.add_argument('--random', type=int, help='try this many configurations of the grid at random')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--n-jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the folds & the random search')
+    parser.add_argument('--output', help='JSON result file')
+    args = parser.parse_args(argv)
+
+    param_grid = {}
+    for option in args.grid:
+        name, _, values = option.partition('=')
+        param_grid[name.replace('-', '_')] = [parse_value(value) for value in values.split(',')]
+    configs = grid_configs(param_grid) if args.random is None else random_configs(param_grid, args.random, args.seed)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        matrix, labels, feature_dict_list, continuous_features, _ = load_dataset(args.data, args.dict_path)
+    start = time.perf_counter()
+    results = cross_validate(matrix, labels, feature_dict_list, continuous_features, configs, args.folds,
+                             args.n_jobs, args.seed)
+    elapsed = time.perf_counter() - start
+
+    front = set(pareto_front(results))
+    print('%-50s %8s %7s %6s %9s %11s' % ('config', 'accuracy', 'std', 'nodes', 'train s', 'predict us'))
+    for i in sorted(range(len(results)), key=lambda i: -results[i]['accuracy']):
+        result = results[i]
+        print('%-50s %8.4f %7.4f %6.1f %9.4f %11.3f %s' % (
+            json.dumps(result['config']), result['accuracy'], result['accuracy_std'], result['nodes'],
+            result['train_seconds'], result['predict_seconds_per_row'] * 1e6, '*' if i in front else ''))
+    print('%d configurations x %d folds in %.2f s' % (len(configs), args.folds, elapsed))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results, 'pareto_front': sorted(front)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """ The definition of PredictionCache, a bounded LRU cache of predicted labels
+
+    The key of a row is the tuple of its encode attribute values. The encode
+    features take only a few values each, so the same rows come again and
+    again. The owner of the cache must clear it when the model changes.
+
+    :param max_size: most rows kept, the least recently used row is dropped first
+    :type max_size: int
+    """
+    def __init__(self, max_size=65536):
+        if max_size < 1:
+            raise ValueError("max_size of PredictionCache must be at least 1")
+        self.max_size = max_size
+        self.labels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get(self, key):
+        """ Returns the cached label of a row
+
+        :param key: encode attribute values of the row
+        :type key: Tuple[int]
+        :return: label, None if the row is not cached
+        :rtype: int
+        """
+        label = self.labels.get(key)
+        if label is None:
+            self.misses += 1
+            return None
+        self.labels.move_to_end(key)
+        self.hits += 1
+        return label
+
+    def put(self, key, label):
+        """ Cache the label of a row
+
+        :param key: encode attribute values of the row
+        :param label: predicted label
+        :type key: Tuple[int]
+        :type label: int
+        """
+        self.labels[key] = label
+        self.labels.move_to_end(key)
+        if len(self.labels) > self.max_size:
+            self.labels.popitem(last=False)
+
+    def clear(self):
+        """ Drop all cached labels, e.g. when the model is retrained or reloaded """
+        self.labels.clear()
+        self.invalidations += 1
+
+    def predict_batch(self, matrix, predict_batch, radices=None):
+        """ Classify many rows through the cache
+
+        Identical rows are merged first, so each distinct row is looked up
+        once and only the distinct rows not cached are routed by predict_batch.
+
+        :param matrix: encode attribute matrix, one row per data
+        :param predict_batch: batch predictor of the model
+        :param radices: number of encode values of each attribute, see unique_rows
+        :type matrix: numpy.ndarray | List[List[int]]
+        :type predict_batch: Callable[[numpy.ndarray], numpy.ndarray]
+        :type radices: List[int]
+        :return: predicted label of each row
+        :rtype: numpy.ndarray
+        """
+        matrix = np.asarray(matrix)
+        if len(matrix) == 0:
+            return predict_batch(matrix)
+        unique, inverse = unique_rows(matrix, radices)
+        labels = np.empty(len(unique), dtype=np.int64)
+        keys = list(map(tuple, unique.tolist()))
+        missing = []
+        for i, key in enumerate(keys):
+            label = self.get(key)
+            if label is None:
+                missing.append(i)
+            else:
+                labels[i] = label
+        if missing:
+            predicted = predict_batch(unique[missing])
+            labels[missing] = predicted
+            for i, label in zip(missing, predicted.tolist()):
+                self.put(keys[i], label)
+        return labels[inverse]
+
+    def stats(self):
+        """ Returns the statistics of the cache
+
+        :return: size, hits, misses, hit rate and number of invalidations
+        :rtype: Dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.labels),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'invalidations': self.invalidations,
+        }
+
+
+def unique_rows(matrix, radices=None):
+    """ Returns the distinct rows of a matrix
+
+    When radices are given and every row fits into one int64, the rows are
+    packed into one integer key each and deduplicated by numpy. Otherwise
+    the rows are deduplicated by a dict of row tuples, which is much faster
+    than numpy.unique on whole rows.
+
+    :param matrix: encode attribute matrix, one row per data
+    :param radices: number of encode values of each attribute, None if unknown
+    :type matrix: numpy.ndarray
+    :type radices: List[int]
+    :return: distinct rows & index of the distinct row of each row
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    if radices is not None and np.prod(np.asarray(radices, dtype=np.float64)) < 2 ** 63 \
+            and np.all(matrix >= 0) and np.all(matrix < np.asarray(radices)):
+        keys = np.zeros(len(matrix), dtype=np.int64)
+        for i, radix in enumerate(radices):
+            keys *= radix
+            keys += matrix[:, i]
+        _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return matrix[index], inverse.reshape(-1)
+    ids = {}
+    inverse = np.fromiter((ids.setdefault(key, len(ids)) for key in map(tuple, matrix.tolist())),
+                          dtype=np.intp, count=len(matrix))
+    # ids are numbered in order of first appearance
+    _, index = np.unique(inverse, return_index=True)
+    return matrix[index], inverse
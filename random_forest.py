@@ -0,0 +1,168 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from decision_tree import DecisionTree
+from shared_array import SharedArray
+
+
+class RandomForest:
+    """ The definition of RandomForest, bagged DecisionTree with per-node feature sampling
+
+    Every tree is trained on a bootstrap sample of the rows and searches its
+    splits by GINI index among max_features sampled features at each node.
+    The forest predicts by majority vote of the trees.
+
+    :param feature_dict_list: dict list  key:encode val:feature (attribute & label)
+    :param continuous_features: index of continuous feature
+    :param n_trees: number of trees
+    :param threshold: when |S| < threshold, it is too small (per tree)
+    :param feature_idx_list: list of feature indexes each tree may split on, None for all
+    :param max_features: number of features sampled at each node, None for the square root of the features
+    :param bootstrap: train each tree on a bootstrap sample, otherwise on all rows
+    :param n_jobs: number of worker processes training the trees
+    :param random_state: seed of the bootstrap & feature sampling, the same seed gives the same forest
+    :param feature_scope: DecisionTree feature_scope of the trees, with 'path' a tree may split on a feature
+        again in other branches
+    :type feature_dict_list: List[Dict[int,str]]
+    :type continuous_features: List[int]
+    :type n_trees: int
+    :type threshold: int
+    :type feature_idx_list: List[int]
+    :type max_features: int
+    :type bootstrap: bool
+    :type n_jobs: int
+    :type random_state: int
+    :type feature_scope: str
+    """
+    def __init__(self, feature_dict_list, continuous_features, n_trees=25, threshold=5, feature_idx_list=None,
+                 max_features=None, bootstrap=True, n_jobs=1, random_state=None, feature_scope='path'):
+        self.feature_dict_list = feature_dict_list
+        self.continuous_features = continuous_features
+        self.n_trees = n_trees
+        self.threshold = threshold
+        self.feature_idx_list = feature_idx_list
+        self.max_features = max_features
+        self.bootstrap = bootstrap
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.feature_scope = feature_scope
+        self.trees = []
+        self.compiled_trees = []
+
+    def create_forest(self, data_list, label_list):
+        """ Train the trees of the forest
+
+        :param data_list: training data
+        :param label_list: training label
+        :type data_list: List[List[int]] | numpy.ndarray
+        :type label_list: List[int] | numpy.ndarray
+        :return: trained trees
+        :rtype: List[DecisionTree]
+        """
+        matrix = np.asarray(data_list)
+        labels = np.asarray(label_list)
+        feature_idx_list = self.feature_idx_list
+        if feature_idx_list is None:
+            feature_idx_list = list(range(matrix.shape[1]))
+        max_features = self.max_features
+        if max_features is None:
+            max_features = max(1, int(np.sqrt(len(feature_idx_list))))
+        params = {
+            'feature_dict_list': self.feature_dict_list,
+            'continuous_features': self.continuous_features,
+            'threshold': self.threshold,
+            'feature_idx_list': feature_idx_list,
+            'max_features': max_features,
+            'bootstrap': self.bootstrap,
+            'feature_scope': self.feature_scope,
+        }
+        # one independent seed per tree, so the forest does not depend on n_jobs
+        seeds = np.random.SeedSequence(self.random_state).spawn(self.n_trees)
+
+        if self.n_jobs > 1:
+            shared_list = [SharedArray.copy_of(matrix), SharedArray.copy_of(labels)]
+            try:
+                specs = [shared.spec() for shared in shared_list]
+                with ProcessPoolExecutor(self.n_jobs, initializer=_init_forest_worker,
+                                         initargs=(specs, params)) as pool:
+                    roots = list(pool.map(_train_tree_worker, seeds))
+            finally:
+                for shared in shared_list:
+                    shared.close()
+        else:
+            roots = [train_tree(matrix, labels, seed, params) for seed in seeds]
+
+        self.trees = [DecisionTree(None, None, self.feature_dict_list, self.continuous_features, root=root,
+                                   threshold=self.threshold, max_features=max_features,
+                                   feature_scope=self.feature_scope)
+                      for root in roots]
+        self.compiled_trees = [tree.compile() for tree in self.trees]
+        return self.trees
+
+    def classify(self, data):
+        """ Classify one data by majority vote of the trees
+
+        :param data: encode attribute values of one data
+        :type data: List[int]
+        :return: label with the most votes, ties go to the smaller label
+        :rtype: int
+        """
+        votes = Counter(compiled.predict(data) for compiled in self.compiled_trees)
+        return min(votes, key=lambda label: (-votes[label], label))
+
+    def predict_batch(self, matrix):
+        """ Classify many rows by majority vote of the trees
+
+        :param matrix: encode attribute matrix, one row per data
+        :type matrix: numpy.ndarray | List[List[int]]
+        :return: label with the most votes of each row, ties go to the smaller label
+        :rtype: numpy.ndarray
+        """
+        matrix = np.asarray(matrix)
+        predictions = np.stack([compiled.predict_batch(matrix) for compiled in self.compiled_trees])
+        labels = np.unique(predictions)
+        votes = np.stack([np.count_nonzero(predictions == label, axis=0) for label in labels])
+        return labels[np.argmax(votes, axis=0)]
+
+
+def train_tree(matrix, labels, seed, params):
+    """ Train one tree of the forest
+
+    :param matrix: training data
+    :param labels: training label
+    :param seed: seed of the bootstrap sample & the feature sampling of the tree
+    :param params: tree options from RandomForest.create_forest
+    :type matrix: numpy.ndarray
+    :type labels: numpy.ndarray
+    :type seed: numpy.random.SeedSequence
+    :type params: Dict
+    :return: root treenode
+    :rtype: TreeNode
+    """
+    rng = np.random.default_rng(seed)
+    if params['bootstrap']:
+        rows = np.sort(rng.integers(0, len(labels), size=len(labels)))
+        matrix = matrix[rows]
+        labels = labels[rows]
+    tree = DecisionTree(matrix, labels, params['feature_dict_list'], params['continuous_features'],
+                        threshold=params['threshold'], max_features=params['max_features'], random_state=rng,
+                        feature_scope=params['feature_scope'])
+    return tree.create_tree(matrix, labels, feature_idx_list=list(params['feature_idx_list']))
+
+
+# state of a forest worker process, set by _init_forest_worker
+_forest_worker = {}
+
+
+def _init_forest_worker(specs, params):
+    shared_list = [SharedArray.attach(spec) for spec in specs]
+    _forest_worker['shared_list'] = shared_list
+    _forest_worker['matrix'] = shared_list[0].array
+    _forest_worker['labels'] = shared_list[1].array
+    _forest_worker['params'] = params
+
+
+def _train_tree_worker(seed):
+    return train_tree(_forest_worker['matrix'], _forest_worker['labels'], seed, _forest_worker['params'])
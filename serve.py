@@ -0,0 +1,412 @@
+""" Serve a trained decision tree over HTTP with micro-batching
+
+Concurrent prediction requests are queued and classified together: a batch
+is closed when it holds --max-batch-size rows or when its first request has
+waited --max-wait-ms, then all its rows go through one call of the batched
+predictor of the compiled tree, e.g.
+
+    python serve.py --model model.dtm --port 8000
+    python load_test.py --port 8000 --concurrency 64 --requests 20000
+
+Endpoints, all JSON:
+
+* POST /predict with {"rows": [[...], ...]} of encode attribute values,
+  returns {"labels": [...]}; {"row": [...]} returns {"label": ...}
+* GET /stats returns the queue depth, the number of requests, rows and
+  batches, the percentiles of the request latency and the batch size and,
+  with --cache-size, the hits & misses of the prediction cache
+* POST /reload loads the model file again and swaps it in between two
+  batches, requests arriving meanwhile wait in the queue. SIGHUP reloads
+  too. {"model": path} loads another model file instead, only when the
+  server runs with --model-dir and only a file inside that directory, e.g.
+  {"model": "v2.dtm"} with --model-dir models. A file that is missing or
+  not a valid model gets the same error, so clients cannot probe the disk.
+
+When --model does not exist, a tree is trained on --data and saved to it.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import json
+import os
+import signal
+import sys
+import time
+
+import numpy as np
+
+from model_file import read_model
+from prediction_cache import PredictionCache
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+                413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+
+class MicroBatcher:
+    """ The definition of MicroBatcher, classifying concurrent requests in batches
+
+    :param model_path: path of the model file, see model_file
+    :param max_batch_size: most rows of a batch
+    :param max_wait: seconds the first request of a batch waits for more rows
+    :param latency_window: number of recent requests & batches kept for the percentiles
+    :param cache_size: keep the labels of up to this many distinct rows, None for no cache
+    :type model_path: str
+    :type max_batch_size: int
+    :type max_wait: float
+    :type latency_window: int
+    :type cache_size: int
+    """
+    def __init__(self, model_path, max_batch_size=256, max_wait=0.002, latency_window=10000, cache_size=None):
+        self.model_path = model_path
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.compiled, self.metadata = read_model(model_path)
+        self.n_features = len(self.metadata['feature_dict_list']) - 1
+        self.model_version = 1
+        self.cache = None if cache_size is None else PredictionCache(cache_size)
+        self.queue = collections.deque()  # (rows, future, enqueue time)
+        self.pending_rows = 0
+        self.n_requests = 0
+        self.n_rows = 0
+        self.n_batches = 0
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.batch_sizes = collections.deque(maxlen=latency_window)
+        self._wakeup = None
+        self._reload_lock = None
+        self._task = None
+
+    def start(self):
+        """ Start the batching task on the running event loop """
+        self._wakeup = asyncio.Event()
+        self._reload_lock = asyncio.Lock()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """ Stop the batching task, queued requests are cancelled """
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        for _, future, _ in self.queue:
+            future.cancel()
+        self.queue.clear()
+
+    async def predict(self, rows):
+        """ Queue rows for the next batch and wait for their labels
+
+        :param rows: encode attribute matrix, one row per data
+        :type rows: numpy.ndarray
+        :return: predicted label of each row
+        :rtype: numpy.ndarray
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((rows, future, time.perf_counter()))
+        self.pending_rows += len(rows)
+        self._wakeup.set()
+        return await future
+
+    async def reload(self, model_path=None):
+        """ Load the model file again, or another model file, and use it for the next batches
+
+        The file is read in a worker thread, so batches go on with the old
+        model until the new one is ready. A model file that cannot be read
+        leaves the old model in place.
+
+        :param model_path: path of the new model file, None for the current one
+        :type model_path: str
+        :return: version number of the model in use
+        :rtype: int
+        :raise ValueError, OSError
+        """
+        model_path = model_path or self.model_path
+        async with self._reload_lock:
+            compiled, metadata = await asyncio.get_running_loop().run_in_executor(None, read_model, model_path)
+            if len(metadata['feature_dict_list']) - 1 != self.n_features:
+                raise ValueError("model %s has %d features (expected %d)" % (
+                    model_path, len(metadata['feature_dict_list']) - 1, self.n_features))
+            # the batching task reads self.compiled once per batch, so no batch sees two models
+            # and no label of the old model is served from the cache
+            self.compiled, self.metadata = compiled, metadata
+            if self.cache is not None:
+                self.cache.clear()
+            self.model_path = model_path
+            self.model_version += 1
+            return self.model_version
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            # the first request of the batch waits at most max_wait for more rows
+            deadline = self.queue[0][2] + self.max_wait
+            while self.pending_rows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+            self._predict_batch()
+            # let the handlers of the finished requests run before the next batch
+            await asyncio.sleep(0)
+
+    def _predict_batch(self):
+        batch = []
+        n_rows = 0
+        while self.queue and (n_rows == 0 or n_rows + len(self.queue[0][0]) <= self.max_batch_size):
+            request = self.queue.popleft()
+            batch.append(request)
+            n_rows += len(request[0])
+        self.pending_rows -= n_rows
+        batch = [request for request in batch if not request[1].cancelled()]
+        if not batch:
+            return
+        try:
+            matrix = np.concatenate([rows for rows, _, _ in batch])
+            if self.cache is None:
+                labels = self.compiled.predict_batch(matrix)
+            else:
+                radices = [len(feature_dict) for feature_dict in self.metadata['feature_dict_list'][:-1]]
+                labels = self.cache.predict_batch(matrix, self.compiled.predict_batch, radices)
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        now = time.perf_counter()
+        start = 0
+        for rows, future, enqueue_time in batch:
+            future.set_result(labels[start:start + len(rows)])
+            start += len(rows)
+            self.latencies.append(now - enqueue_time)
+        self.n_requests += len(batch)
+        self.n_rows += start
+        self.n_batches += 1
+        self.batch_sizes.append(start)
+
+    def stats(self):
+        """ Returns the serving statistics
+
+        :return: queue depth, totals, model version & percentiles of the latency (ms) and batch size
+        :rtype: Dict
+        """
+        stats = {
+            'queue_requests': len(self.queue),
+            'queue_rows': self.pending_rows,
+            'requests': self.n_requests,
+            'rows': self.n_rows,
+            'batches': self.n_batches,
+            'model': self.model_path,
+            'model_version': self.model_version,
+        }
+        if self.latencies:
+            p50, p90, p99, p_max = np.percentile(np.array(self.latencies) * 1000, [50, 90, 99, 100]).tolist()
+            stats['latency_ms'] = {'p50': p50, 'p90': p90, 'p99': p99, 'max': p_max}
+            p50, p_max = np.percentile(self.batch_sizes, [50, 100]).tolist()
+            stats['batch_rows'] = {'mean': float(np.mean(self.batch_sizes)), 'p50': p50, 'max': p_max}
+        if self.cache is not None:
+            stats['cache'] = self.cache.stats()
+        return stats
+
+
+class PredictionServer:
+    """ The definition of PredictionServer, a minimal HTTP/1.1 JSON server in front of a MicroBatcher
+
+    Connections are kept alive, so a client can send many requests on one
+    connection.
+
+    :param batcher: micro-batcher classifying the rows
+    :param model_dir: directory of the model files /reload may load, None to only reload the current model
+    :type batcher: MicroBatcher
+    :type model_dir: str
+    """
+    def __init__(self, batcher, model_dir=None):
+        self.batcher = batcher
+        self.model_dir = None if model_dir is None else os.path.realpath(model_dir)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                if len(parts) != 3:
+                    break
+                method, path, version = parts
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await self.write_response(writer, 413, {'error': 'request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, response = await self.dispatch(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                await self.write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def dispatch(self, method, path, body):
+        """ Answer one request
+
+        :param method: HTTP method
+        :param path: request path
+        :param body: request body
+        :type method: str
+        :type path: str
+        :type body: bytes
+        :return: HTTP status & JSON response
+        :rtype: int, Dict
+        """
+        path = path.split('?')[0]
+        routes = {'/predict': ('POST', self.predict), '/stats': ('GET', self.stats), '/reload': ('POST', self.reload)}
+        if path not in routes:
+            return 404, {'error': 'unknown path %s' % path}
+        expected_method, handler = routes[path]
+        if method != expected_method:
+            return 405, {'error': '%s expects %s' % (path, expected_method)}
+        try:
+            request = json.loads(body) if body else {}
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+            return 200, await handler(request)
+        except PermissionError as e:
+            return 403, {'error': str(e)}
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': '%s: %s' % (type(e).__name__, e)}
+
+    async def predict(self, request):
+        single = 'row' in request
+        rows = [request['row']] if single else request.get('rows')
+        if not isinstance(rows, list) or len(rows) == 0:
+            raise ValueError('expected "row" or a non-empty list of "rows"')
+        try:
+            matrix = np.array(rows, dtype=np.int64)
+        except (TypeError, ValueError):
+            raise ValueError("rows must be lists of encode attribute values")
+        if matrix.ndim != 2 or matrix.shape[1] != self.batcher.n_features:
+            raise ValueError("each row must have %d encode attribute values" % self.batcher.n_features)
+        labels = (await self.batcher.predict(matrix)).tolist()
+        return {'label': labels[0]} if single else {'labels': labels}
+
+    async def stats(self, request):
+        return self.batcher.stats()
+
+    async def reload(self, request):
+        model_path = request.get('model')
+        if model_path is not None:
+            model_path = self.resolve_model_path(model_path)
+        try:
+            version = await self.batcher.reload(model_path)
+        except (OSError, ValueError) as e:
+            # the reason stays in the server log, the client cannot tell a missing file from a bad one
+            print('reload of %s failed: %s' % (model_path or self.batcher.model_path, e), file=sys.stderr)
+            raise ValueError('the model cannot be loaded')
+        return {'model': self.batcher.model_path, 'model_version': version}
+
+    def resolve_model_path(self, model_path):
+        """ Returns the path of a model file requested by /reload, if it may be loaded
+
+        :param model_path: path relative to model_dir
+        :type model_path: str
+        :rtype: str
+        :raise ValueError, PermissionError
+        """
+        if not isinstance(model_path, str) or not model_path:
+            raise ValueError('"model" must be the path of a model file')
+        if self.model_dir is None:
+            raise PermissionError('loading another model is disabled, start the server with --model-dir')
+        # symbolic links are resolved before the check, so they cannot lead out of model_dir
+        path = os.path.realpath(os.path.join(self.model_dir, model_path))
+        if not path.startswith(os.path.join(self.model_dir, '')):
+            raise PermissionError('"model" must be a file inside --model-dir')
+        return path
+
+    @staticmethod
+    async def write_response(writer, status, response, keep_alive):
+        body = json.dumps(response).encode('utf-8')
+        writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                      'Connection: %s\r\n\r\n' % (status, HTTP_REASONS[status], len(body),
+                                                  'keep-alive' if keep_alive else 'close')).encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+
+def train_model(model_path, data_path, dict_path):
+    """ Train a tree like main.py and save it to a model file
+
+    :param model_path: path of the new model file
+    :param data_path: adult data file
+    :param dict_path: feature dictionary
+    :type model_path: str
+    :type data_path: str
+    :type dict_path: str
+    """
+    from data_process import load_dataset
+    from decision_tree import DecisionTree
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        data, labels, feature_dict_list, continuous_features, _ = load_dataset(data_path, dict_path)
+    tree = DecisionTree(data, labels, feature_dict_list, continuous_features, threshold=5)
+    tree.create_tree(data, labels, feature_idx_list=list(range(data.shape[1])))
+    tree.save(model_path)
+
+
+async def serve(args):
+    batcher = MicroBatcher(args.model, args.max_batch_size, args.max_wait_ms / 1000, cache_size=args.cache_size)
+    batcher.start()
+    server = await asyncio.start_server(PredictionServer(batcher, args.model_dir).handle_connection, args.host,
+                                        args.port, backlog=1024)
+    loop = asyncio.get_running_loop()
+
+    def reload_on_signal():
+        loop.create_task(batcher.reload())
+    with contextlib.suppress(NotImplementedError, AttributeError):  # no signals on Windows
+        loop.add_signal_handler(signal.SIGHUP, reload_on_signal)
+    print('Serving %s on http://%s:%d (max batch %d rows, max wait %g ms)' % (
+        args.model, args.host, server.sockets[0].getsockname()[1], args.max_batch_size, args.max_wait_ms))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--model', default='model.dtm', help='model file written by DecisionTree.save')
+    parser.add_argument('--data', default='adult/adult.data', help='training data when the model does not exist')
+    parser.add_argument('--dict-path', default='my_dict.json', help='feature dictionary')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=256, help='most rows of a batch')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='most wait of a request for its batch')
+    parser.add_argument('--cache-size', type=int, help='cache the labels of this many distinct rows')
+    parser.add_argument('--model-dir', help='let /reload load other model files of this directory')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.model):
+        print('Training a decision tree on %s...' % args.data)
+        train_model(args.model, args.data, args.dict_path)
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main()
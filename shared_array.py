@@ -0,0 +1,98 @@
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+class SharedArray:
+    """ The definition of SharedArray, a numpy array in shared memory
+
+    The creating process owns the memory and unlinks it, worker processes
+    attach to it by the spec() of the owner instead of receiving a pickled copy.
+
+    :param shape: shape of the array
+    :param dtype: data type of the array
+    :param order: 'C' row major or 'F' column major
+    :param name: name of an existing shared memory block to attach to, None to create one
+    :type shape: Tuple[int, ...]
+    :type dtype: numpy.dtype | str
+    :type order: str
+    :type name: str
+    """
+    def __init__(self, shape, dtype, order='C', name=None):
+        dtype = np.dtype(dtype)
+        self.is_owner = name is None
+        if self.is_owner:
+            size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            self.shm = SharedMemory(create=True, size=size)
+        else:
+            self.shm = attach_shared_memory(name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, order=order)
+        self.order = order
+
+    @classmethod
+    def copy_of(cls, array, order='K'):
+        """ Create a SharedArray holding a copy of array
+
+        :param array: source array
+        :param order: memory layout, 'K' keeps the layout of the source
+        :type array: numpy.ndarray
+        :type order: str
+        :rtype: SharedArray
+        """
+        array = np.asarray(array)
+        if order == 'K':
+            order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+        shared = cls(array.shape, array.dtype, order=order)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        """ Attach to the SharedArray described by spec
+
+        :param spec: (name, shape, dtype, order) from SharedArray.spec
+        :type spec: Tuple[str, Tuple[int, ...], str, str]
+        :rtype: SharedArray
+        """
+        name, shape, dtype, order = spec
+        return cls(shape, dtype, order=order, name=name)
+
+    def spec(self):
+        """ Returns the picklable description used by attach
+
+        :rtype: Tuple[str, Tuple[int, ...], str, str]
+        """
+        return self.shm.name, self.array.shape, self.array.dtype.str, self.order
+
+    def close(self):
+        """ Release the array, the owner also frees the shared memory
+        """
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:  # views of the array are still alive, the memory is freed with them
+            pass
+        if self.is_owner:
+            self.shm.unlink()
+
+
+def attach_shared_memory(name):
+    """ Attach to a shared memory block without registering it to the resource tracker
+
+    Only the owner may unlink the block, otherwise the resource tracker of a
+    worker would remove it when the worker exits.
+
+    :param name: name of the shared memory block
+    :type name: str
+    :rtype: SharedMemory
+    """
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
@@ -1,15 +1,23 @@
 class TreeNode:
     """ The definition of TreeNode
 
+    A split node sends data with data[attr_idx] == attr_val (<= attr_val for a
+    continuous attribute) to true_brunch and the other data to false_brunch.
+    stats holds the class-count statistics used by DecisionTree.update and
+    row_stats the number of rows behind them, which differ with sample
+    weights; both None when they are not collected.
+
     :param is_leaf: if leave node
-    :param result: label of node
-    :param attr_idx: attribute index of the split
-    :param attr_val: attribute value of the split
+    :param result: label of node, the majority training label for a split node
+    :param attr_idx: attribute index of the split, -1 for leave node
+    :param attr_val: attribute value of the split, -1 for leave node
     :type is_leaf: bool
     :type result: int
     :type attr_idx: int
     :type attr_val: int
     """
+    __slots__ = ('true_brunch', 'false_brunch', 'is_leaf', 'result', 'attr_idx', 'attr_val', 'stats', 'row_stats')
+
     def __init__(self, is_leaf=False, result=-1, attr_idx=-1, attr_val=-1):
         self.true_brunch = None
         self.false_brunch = None
@@ -17,3 +25,5 @@ class TreeNode:
         self.result = result
         self.attr_idx = attr_idx
         self.attr_val = attr_val
+        self.stats = None
+        self.row_stats = None